@@ -0,0 +1,3 @@
+"""
+genwg benchmarks
+"""
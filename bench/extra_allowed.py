@@ -0,0 +1,81 @@
+import argparse
+import logging
+import os
+import tempfile
+import time
+
+from genwg.config import ConfigYAML
+from genwg.genfiles import GenFiles
+
+
+def gen_fleet(clients, routes):
+    # every client routes the same pool of networks, the worst case for the
+    # membership checks against the server wide set
+    networks = [f"10.{128 + i // 256}.{i % 256}.0/24" for i in range(routes)]
+
+    return {
+        "servers": [
+            {
+                "name": "wg0",
+                "ip": "1.1.1.1",
+                "port": 51820,
+                "net": "10.0.0.0/9",
+                "mtu": 1420,
+                "extra_allowed": ["192.168.0.0/16"],
+                "clients": [
+                    {"name": f"client{i}", "extra_allowed": networks}
+                    for i in range(clients)
+                ],
+            }
+        ]
+    }
+
+
+def bench(clients, routes, logger):
+    config = ConfigYAML(None, logger)
+    # no priv keys, keys are never derived here
+    config.yaml_parsed = gen_fleet(clients, routes)
+
+    start = time.perf_counter()
+    config.parse_yaml()
+    parse_time = time.perf_counter() - start
+
+    genfiles = GenFiles(config, logger)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cwd = os.getcwd()
+        os.chdir(tmpdir)
+        os.mkdir("genwg_dump")
+
+        try:
+            start = time.perf_counter()
+            genfiles.dump_yaml()
+            dump_time = time.perf_counter() - start
+        finally:
+            os.chdir(cwd)
+
+    return parse_time, dump_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description="genwg extra_allowed benchmark")
+    parser.add_argument("-n", type=int, default=10000, help="number of clients.")
+    parser.add_argument("-r", type=int, default=100, help="routes per client.")
+    args = parser.parse_args()
+
+    logger = logging.getLogger("bench")
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+
+    # linear scaling shows up as a flat per client cost across the sizes
+    for clients in (args.n // 4, args.n // 2, args.n):
+        parse_time, dump_time = bench(clients, args.r, logger)
+        print(
+            f"{clients:>6} clients x {args.r} routes: "
+            f"parse {parse_time:.3f}s ({parse_time / clients * 1e6:.1f}us/client), "
+            f"dump {dump_time:.3f}s ({dump_time / clients * 1e6:.1f}us/client)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+import base64
+import hashlib
+import logging
+
+
+def fake_key(seed):
+    # well formed but made up, only for paths that never derive anything
+    return base64.b64encode(hashlib.sha256(seed.encode()).digest()).decode()
+
+
+def gen_fleet(
+    servers=1,
+    clients=100,
+    *,
+    udp2raw=False,
+    named=False,
+    android=False,
+    bind=False,
+    extra_allowed=0,
+    priv=True,
+):
+    # clients per server: /16 nets leave room for up to 65k of them
+    doc = {"servers": []}
+
+    for s in range(servers):
+        server = {
+            "name": f"wg{s}",
+            "ip": "1.1.1.1",
+            "port": 20000 + s,
+            "net": f"10.{s}.0.0/16",
+            "mtu": 1340 if udp2raw else 1420,
+            "clients": [],
+        }
+
+        if priv:
+            server["priv"] = fake_key(server["name"])
+
+        if udp2raw:
+            server["udp2raw"] = {"port": 40000 + s, "secret": "secret"}
+
+        if named:
+            server["named"] = {"hostname": "ns", "conf_dir": "/etc/bind"}
+
+        if extra_allowed:
+            server["extra_address"] = [f"192.168.{s}.1/32"]
+
+        for c in range(clients):
+            client = {"name": f"c{c}"}
+
+            if priv:
+                client["priv"] = fake_key(f"{server['name']}-{client['name']}")
+
+            if udp2raw:
+                client["udp2raw_log_path"] = "/var/log/udp2raw.log"
+
+                if android and c % 2:
+                    client["android"] = True
+                    client["wgquick_path"] = "/system/bin/wg-quick"
+                    client["udp2raw_path"] = "/system/bin/udp2raw"
+
+            if bind and not (android and c % 2):
+                client["bind"] = True
+                client["root_zone_file"] = "/var/named/root"
+            elif c % 3 == 0:
+                client["wg_handled_dns"] = True
+
+            # one in every 50 clients is a site router with lans behind it
+            if extra_allowed and c % 50 == 0:
+                client["append_extra"] = True
+                client["extra_allowed"] = [
+                    f"172.{16 + c // 50 % 16}.{(c // 800 + i) % 256}.0/24"
+                    for i in range(extra_allowed)
+                ]
+
+            server["clients"].append(client)
+
+        doc["servers"].append(server)
+
+    return doc
+
+
+def null_logger():
+    logger = logging.getLogger("bench")
+    logger.propagate = False
+
+    if not logger.handlers:
+        logger.addHandler(logging.NullHandler())
+
+    return logger
+
+
+def parse_fleet(doc, logger=None):
+    # parses a fleet without deriving keys, public keys are faked
+    from genwg.config import ConfigYAML
+
+    config = ConfigYAML(None, logger or null_logger())
+    config.yaml_parsed = doc
+    config.parse_yaml()
+
+    for server in config.servers:
+        server.pub = fake_key(f"pub-{server.priv}")
+
+        for client in server.clients:
+            client.pub = fake_key(f"pub-{client.priv}")
+
+    return config
@@ -0,0 +1,7 @@
+$TTL 5M
+@ IN SOA dualstack. root.dualstack. ( 1 1W 1D 4W 1W )
+@ IN NS ns1.dualstack.
+
+1.0.0.0.0.0.0.0.0.0.0.0.0.0.0.0 IN PTR ns1.dualstack.
+2.0.0.0.0.0.0.0.0.0.0.0.0.0.0.0 IN PTR desktop.dualstack.
+3.0.0.0.0.0.0.0.0.0.0.0.0.0.0.0 IN PTR laptop.dualstack.
@@ -0,0 +1,180 @@
+import argparse
+import shutil
+import subprocess
+import sys
+import time
+
+from genwg.keys import (
+    _BASE_U,
+    WGBackend,
+    WGKeyError,
+    X25519Backend,
+    _x25519,
+    _x25519_base,
+)
+
+# rfc 7748 section 5.2, scalar, u coordinate, output
+VECTORS = (
+    (
+        "a546e36bf0527c9d3b16154b82465edd62144c0ac1fc5a18506a2244ba449ac4",
+        "e6db6867583030db3594c1a424b15f7c726624ec26b3353b10a903a6d0ab1c4c",
+        "c3da55379de9c6908e94ea4df28d084f32eccf03491c71f754b4075577a28552",
+    ),
+    (
+        "4b66e9d4d1b4673c5ad22691957d6af5c11b6421e0ea01d42ca4169e7918ba0d",
+        "e5210f12786811d3f4b7959d0538ae2c31dbe7106fc03c3efc4cd549c715a493",
+        "95cbde9476e8907d7aade45cb4b873f88b595a68799fa152e6f8f7647aac7957",
+    ),
+)
+
+# rfc 7748 section 5.2, k and u starting at 9, output after that many rounds
+ITERATIONS = (
+    (1, "422c8e7a6227d7bca1350b3e2bb7279f7897b87bb6854b783c60e80311ae3079"),
+    (1000, "684cf59ba83309552800ef566f2f4d3c1c3887c49360e3875f2eb94d99532c51"),
+)
+
+# rfc 7748 section 6.1, alice and bob, private and public key
+KEYPAIRS = (
+    (
+        "77076d0a7318a57d3c16c17251b26645df4c2f87ebc0992ab177fba51db92c2a",
+        "8520f0098930a754748b7ddcb43ef75a0dbf3a0d26381af4eba4a98eaa9b4e6a",
+    ),
+    (
+        "5dab087e624a8a4b79e17f8b83800ee66f3bb1292618b6fd1c2f8b27ff88e0eb",
+        "de9edb7d7b7dc1b4d35b61c2ece435373f8343c85b78674dadfc7e146f882b4f",
+    ),
+)
+SHARED = "4a5d9d5ba4ce2de1728e3bf480350f25e07e21c947d19e3376f09b3c1e161742"
+
+# keys wg pubkey turns down, 31 bytes behind 44 chars, unpadded, not base64
+MALFORMED = ("A" * 42 + "==", "A" * 44, "A" * 43 + "!", "A" * 43 + "=" + "A")
+
+
+def _u(raw):
+    # the most significant bit of a u coordinate is ignored
+    return int.from_bytes(raw, "little") & ((1 << 255) - 1)
+
+
+def check_vectors():
+    failed = []
+
+    for scalar, u, output in VECTORS:
+        if _x25519(bytes.fromhex(scalar), _u(bytes.fromhex(u))).hex() != output:
+            failed.append(f"5.2 vector {scalar[:8]}")
+
+    k = u = _BASE_U.to_bytes(32, "little")
+    done = 0
+    for rounds, output in ITERATIONS:
+        for _ in range(rounds - done):
+            k, u = _x25519(k, _u(u)), k
+        done = rounds
+
+        if k.hex() != output:
+            failed.append(f"5.2 after {rounds} iterations")
+
+    for priv, pub in KEYPAIRS:
+        priv = bytes.fromhex(priv)
+
+        if _x25519(priv, _BASE_U).hex() != pub:
+            failed.append(f"6.1 public key {pub[:8]}, ladder")
+        if _x25519_base(priv).hex() != pub:
+            failed.append(f"6.1 public key {pub[:8]}, base table")
+
+    (alice, alice_pub), (bob, bob_pub) = KEYPAIRS
+    for priv, pub in ((alice, bob_pub), (bob, alice_pub)):
+        if _x25519(bytes.fromhex(priv), _u(bytes.fromhex(pub))).hex() != SHARED:
+            failed.append(f"6.1 shared secret of {priv[:8]}")
+
+    backend = X25519Backend()
+    for key in MALFORMED:
+        try:
+            backend.pubkey(key)
+        except WGKeyError:
+            continue
+
+        failed.append(f"malformed key {key[-4:]!r}")
+
+    return failed
+
+
+def bench_backend(backend, peers):
+    start = time.perf_counter()
+
+    keys = []
+    for _ in range(peers):
+        priv = backend.genkey()
+        keys.append((priv, backend.pubkey(priv)))
+
+    return time.perf_counter() - start, keys
+
+
+def bench_exec(peers):
+    # what the wg backend can not go below, two fork+execs of a no-op per peer
+    start = time.perf_counter()
+
+    for _ in range(peers * 2):
+        subprocess.run(["true"], check=True)
+
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="genwg key backend benchmark")
+    parser.add_argument("-n", type=int, default=10000, help="number of peers.")
+    parser.add_argument("--wg-bin", default="wg", help="wg binary to compare against.")
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help=(
+            "only check the rfc 7748 test vectors and malformed keys, exits 1 if "
+            "one fails."
+        ),
+    )
+    args = parser.parse_args()
+
+    # always, whether wg is around or not
+    failed = check_vectors()
+    for vector in failed:
+        print(f"x25519 failed the {vector} test vector")
+    if failed:
+        sys.exit(1)
+
+    print("x25519 passed the rfc 7748 test vectors")
+    if args.check:
+        sys.exit(0)
+
+    backends = [X25519Backend()]
+    if shutil.which(args.wg_bin):
+        backends.append(WGBackend(args.wg_bin))
+    else:
+        print(f"{args.wg_bin} not found, skipping the wg backend", file=sys.stderr)
+
+    results = {}
+    for backend in backends:
+        elapsed, keys = bench_backend(backend, args.n)
+        results[backend.name] = keys
+
+        print(
+            f"{backend.name:>8}: {args.n} peers in {elapsed:.3f}s "
+            f"({args.n / elapsed:.0f} peers/s)"
+        )
+
+    elapsed = bench_exec(args.n)
+    print(
+        f"{'exec':>8}: {args.n} peers in {elapsed:.3f}s "
+        f"({args.n / elapsed:.0f} peers/s), 2 fork+execs of true per peer"
+    )
+
+    # the in-process backend has to agree with every other one on every key
+    reference = backends[0]
+    for backend in backends[1:]:
+        for priv, pub in results[backend.name]:
+            if reference.pubkey(priv) != pub:
+                print(f"{reference.name} disagrees with {backend.name} on {priv}")
+                sys.exit(1)
+
+        print(f"{reference.name} and {backend.name} produced identical public keys")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+
+from genwg import __version__ as genwg_version
+from genwg.constants import RENDERERS
+
+from .fleet import gen_fleet, null_logger
+
+# name -> gen_fleet() arguments
+SHAPES = {
+    "1x10": {"servers": 1, "clients": 10},
+    "1x1k-udp2raw-android": {
+        "servers": 1,
+        "clients": 1000,
+        "udp2raw": True,
+        "android": True,
+    },
+    "10x1k-named-bind": {"servers": 10, "clients": 1000, "named": True, "bind": True},
+    "10x1k-mixed": {
+        "servers": 10,
+        "clients": 1000,
+        "udp2raw": True,
+        "android": True,
+        "named": True,
+        "bind": True,
+        "extra_allowed": 4,
+    },
+    "100x100": {"servers": 100, "clients": 100},
+    "1x10k-extra-allowed": {"servers": 1, "clients": 10000, "extra_allowed": 100},
+    "1x50k-named": {"servers": 1, "clients": 50000, "named": True},
+}
+
+# stands in for wg, hands the private key back as the public one so that
+# only the subprocess round trips get measured
+_FAKE_WG = """#!/bin/sh
+case "$1" in
+genkey) head -c 32 /dev/urandom | base64 ;;
+pubkey) read -r key; printf '%s\\n' "$key" ;;
+*) exit 1 ;;
+esac
+"""
+
+
+def run_shape(shape, rounds, *, keys, jobs, writers, renderer):
+    # runs in a process of its own, so peak rss is that of the shape alone
+    from genwg.config import ConfigYAML
+    from genwg.genfiles import GenFiles
+    from genwg.keys import get_backend
+    from genwg.loader import dump
+    from genwg.profiling import Profiler
+
+    logger = null_logger()
+    best = None
+
+    with tempfile.TemporaryDirectory(prefix="genwg-bench-") as tmp:
+        os.chdir(tmp)
+
+        with open("fleet.yml", "w", encoding="utf-8") as fleet_file:
+            fleet_file.write(dump(gen_fleet(**shape)))
+
+        with open("wg", "w", encoding="utf-8") as wg_file:
+            wg_file.write(_FAKE_WG)
+        os.chmod("wg", 0o755)
+
+        backend = get_backend("wg", os.path.join(tmp, "wg"))
+        if keys == "x25519":
+            backend = get_backend("x25519")
+
+        for _ in range(rounds):
+            profiler = Profiler()
+
+            config = ConfigYAML(
+                "fleet.yml",
+                logger,
+                key_backend=backend,
+                jobs=jobs,
+                pool="thread",
+                leases_file=None,
+                profiler=profiler,
+            )
+            config.run()
+
+            GenFiles(
+                config, logger, writers=writers, renderer=renderer, profiler=profiler
+            ).run()
+
+            report = profiler.report()
+            phases = {
+                name: phase["wall_seconds"] for name, phase in report["phases"].items()
+            }
+
+            # best of the rounds, phase by phase
+            if best is None:
+                best = report
+                best["phases"] = phases
+            else:
+                for name, seconds in phases.items():
+                    best["phases"][name] = min(best["phases"][name], seconds)
+
+                best["wall_seconds"] = min(best["wall_seconds"], report["wall_seconds"])
+                best["peak_rss_bytes"] = report["peak_rss_bytes"]
+
+        os.chdir("/")
+
+    return {
+        "params": shape,
+        "wall_seconds": best["wall_seconds"],
+        "peak_rss_bytes": best["peak_rss_bytes"],
+        "phases": best["phases"],
+        "counts": best["counts"],
+    }
+
+
+def compare(results, baseline, threshold, min_delta):
+    # phases slower than the baseline by more than threshold (a fraction)
+    # and min_delta seconds
+    regressions = []
+
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+
+        old_phases = dict(baseline[name]["phases"])
+        old_phases["total"] = baseline[name]["wall_seconds"]
+        new_phases = dict(result["phases"])
+        new_phases["total"] = result["wall_seconds"]
+
+        for phase, new in new_phases.items():
+            old = old_phases.get(phase)
+
+            if old is None:
+                continue
+
+            if new > old * (1 + threshold) and new - old > min_delta:
+                regressions.append((name, phase, old, new))
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="genwg pipeline benchmark")
+    parser.add_argument(
+        "-s",
+        dest="shapes",
+        action="append",
+        choices=SHAPES.keys(),
+        help="shape to run, can be repeated. all of them by default.",
+    )
+    parser.add_argument(
+        "--scale", type=float, default=1.0, help="multiply client counts by this."
+    )
+    parser.add_argument("-r", type=int, default=3, help="rounds, best one counts.")
+    parser.add_argument(
+        "-k",
+        dest="keys",
+        choices=("fake-wg", "x25519"),
+        default="fake-wg",
+        help="key backend, a fake wg binary or the in-process one.",
+    )
+    parser.add_argument(
+        "-j", type=int, default=os.cpu_count() or 1, help="key derivation workers."
+    )
+    parser.add_argument("-w", type=int, default=4, help="writer threads.")
+    parser.add_argument(
+        "-e", dest="renderer", choices=RENDERERS, default="jinja", help="renderer."
+    )
+    parser.add_argument("-o", dest="output", help="write results as json.")
+    parser.add_argument("-b", dest="baseline", help="json results to compare to.")
+    parser.add_argument(
+        "-t",
+        dest="threshold",
+        type=float,
+        default=0.2,
+        help="fail when a phase is this much slower than the baseline.",
+    )
+    parser.add_argument(
+        "--min-delta",
+        type=float,
+        default=0.05,
+        help="ignore regressions smaller than this many seconds.",
+    )
+    args = parser.parse_args()
+
+    results = {}
+    context = multiprocessing.get_context("spawn")
+
+    for name in args.shapes or SHAPES:
+        shape = dict(SHAPES[name])
+        shape["clients"] = max(1, int(shape["clients"] * args.scale))
+
+        with context.Pool(1) as pool:
+            result = pool.apply(
+                run_shape,
+                (shape, args.r),
+                {
+                    "keys": args.keys,
+                    "jobs": args.j,
+                    "writers": args.w,
+                    "renderer": args.renderer,
+                },
+            )
+
+        results[name] = result
+
+        phases = " ".join(
+            f"{phase}={seconds * 1e3:.0f}ms"
+            for phase, seconds in result["phases"].items()
+        )
+        print(
+            f"{name:>22}: {result['wall_seconds']:.2f}s, "
+            f"{result['peak_rss_bytes'] / 2**20:.0f}MiB, {phases}"
+        )
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            json.dump(
+                {
+                    "meta": {
+                        "genwg": genwg_version,
+                        "python": platform.python_version(),
+                        "platform": platform.platform(),
+                        "scale": args.scale,
+                        "keys": args.keys,
+                        "renderer": args.renderer,
+                    },
+                    "shapes": results,
+                },
+                output_file,
+                indent=1,
+            )
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as baseline_file:
+            baseline = json.load(baseline_file)["shapes"]
+
+        regressions = compare(results, baseline, args.threshold, args.min_delta)
+
+        for name, phase, old, new in regressions:
+            print(
+                f"regression: {name} {phase} {old * 1e3:.0f}ms -> {new * 1e3:.0f}ms "
+                f"(+{(new / old - 1) * 100:.0f}%)"
+            )
+
+        if regressions:
+            sys.exit(1)
+
+        print(f"no regressions over {args.threshold * 100:.0f}% against the baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+import argparse
+import difflib
+import logging
+import os
+import shutil
+import sys
+import time
+
+from genwg.api import load
+from genwg.constants import RENDERERS
+from genwg.fastrender import FastRenderer
+from genwg.genfiles import GenFiles
+from genwg.render import enable_bytecode_cache, get_template
+from genwg.writer import MemoryWriter, write_atomic
+
+from .fleet import gen_fleet, parse_fleet
+
+# config.yml and every file it renders to, zone serials pinned
+GOLDEN = os.path.join(os.path.dirname(os.path.abspath(__file__)), "golden")
+GOLDEN_SERIAL = 1
+
+SHAPES = {
+    "plain": {},
+    "udp2raw+android": {"udp2raw": True, "android": True},
+    "bind+extra_allowed": {"named": True, "bind": True, "extra_allowed": 4},
+    "udp2raw+android+bind": {
+        "udp2raw": True,
+        "android": True,
+        "bind": True,
+        "extra_allowed": 2,
+    },
+}
+
+
+def gen_shape(clients, **kwargs):
+    doc = gen_fleet(clients=clients, **kwargs)
+
+    # dual-stack, behind an fqdn, when there is no udp2raw to rule it out
+    if not kwargs.get("udp2raw"):
+        doc["servers"][0]["ip"] = "vpn.example.com"
+        doc["servers"][0]["net6"] = "fd00::/64"
+
+    return parse_fleet(doc).servers
+
+
+def jinja_client(server, client):
+    return get_template("wg_client.conf.j2").render(server=server, client=client)
+
+
+def jinja_server(server):
+    return get_template("wg_server.conf.j2").render(server=server)
+
+
+def bench_client(servers, rounds, render):
+    peers = 0
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for server in servers:
+            for client in server.clients:
+                render(server, client)
+                peers += 1
+
+    return peers, time.perf_counter() - start
+
+
+def bench_server(servers, rounds, render):
+    peers = 0
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for server in servers:
+            render(server)
+            peers += len(server.clients)
+
+    return peers, time.perf_counter() - start
+
+
+def _diff(expected, got, fromfile, tofile):
+    sys.stdout.writelines(
+        difflib.unified_diff(
+            expected.splitlines(True), got.splitlines(True), fromfile, tofile
+        )
+    )
+
+
+def render_golden(renderer):
+    with open(os.path.join(GOLDEN, "config.yml"), "r", encoding="utf-8") as f:
+        config = load(f)
+
+    writer = MemoryWriter()
+    genfiles = GenFiles(
+        config, logging.getLogger("genwg"), writer=writer, renderer=renderer
+    )
+    genfiles.serial_base = GOLDEN_SERIAL
+    genfiles.render()
+
+    return writer.files
+
+
+def read_golden():
+    files = {}
+
+    for dirpath, _, filenames in os.walk(GOLDEN):
+        for filename in filenames:
+            path = os.path.relpath(os.path.join(dirpath, filename), GOLDEN)
+
+            if path != "config.yml":
+                with open(os.path.join(GOLDEN, path), "r", encoding="utf-8") as f:
+                    files[path] = f.read()
+
+    return files
+
+
+def update_golden():
+    for subdir in ("server", "client", "bind"):
+        shutil.rmtree(os.path.join(GOLDEN, subdir), ignore_errors=True)
+
+    files = render_golden("jinja")
+
+    for path, data in files.items():
+        os.makedirs(os.path.dirname(os.path.join(GOLDEN, path)), exist_ok=True)
+        write_atomic(os.path.join(GOLDEN, path), data)
+
+    return len(files)
+
+
+def check_golden(renderer):
+    # every file has to match the checked in one byte for byte, and no file
+    # may go missing or show up
+    expected = read_golden()
+    got = render_golden(renderer)
+    ok = True
+
+    for path in sorted(expected.keys() | got.keys()):
+        if path not in got:
+            print(f"golden {renderer}: {path} is missing")
+            ok = False
+        elif path not in expected:
+            print(f"golden {renderer}: {path} is not in {GOLDEN}")
+            ok = False
+        elif expected[path] != got[path]:
+            print(f"golden {renderer}: {path} differs")
+            _diff(expected[path], got[path], "golden", renderer)
+            ok = False
+
+    return ok, len(got)
+
+
+def check(shape, servers, fast):
+    # every file of the fast renderer has to match jinja byte for byte
+    for server in servers:
+        pairs = [
+            (
+                f"server/{server.name}.conf",
+                jinja_server(server),
+                fast.render("wg_server.conf.j2", server),
+            )
+        ]
+        pairs += (
+            (
+                f"client/{client.name}-{server.name}.conf",
+                jinja_client(server, client),
+                fast.render("wg_client.conf.j2", server, client),
+            )
+            for client in server.clients
+        )
+
+        for path, expected, got in pairs:
+            if expected != got:
+                print(f"{shape}: {path} differs")
+                _diff(expected, got, "jinja", "fast")
+                return False
+
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="genwg render benchmark")
+    parser.add_argument("-n", type=int, default=5000, help="number of clients.")
+    parser.add_argument("-r", type=int, default=3, help="rounds.")
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help=(
+            "only check both renderers against the golden files and the fast "
+            "renderer against jinja, exits 1 if one differs."
+        ),
+    )
+    parser.add_argument(
+        "--update-golden",
+        action="store_true",
+        help="render the golden files again with jinja.",
+    )
+    args = parser.parse_args()
+
+    fast = FastRenderer()
+
+    if args.update_golden:
+        print(f"{update_golden()} golden files written to {GOLDEN}")
+        sys.exit(0)
+
+    if args.check:
+        ok = True
+
+        for renderer in RENDERERS:
+            golden_ok, files = check_golden(renderer)
+
+            if golden_ok:
+                print(f"{'golden ' + renderer:>20}: {files} files match")
+            else:
+                ok = False
+
+        for shape, kwargs in SHAPES.items():
+            servers = gen_shape(args.n, **kwargs)
+
+            if check(shape, servers, fast):
+                print(f"{shape:>20}: {len(servers[0].clients)} clients match")
+            else:
+                ok = False
+
+        sys.exit(0 if ok else 1)
+
+    # first lookup compiles (or loads from the bytecode cache, as the cli)
+    enable_bytecode_cache()
+    start = time.perf_counter()
+    get_template("wg_client.conf.j2")
+    get_template("wg_server.conf.j2")
+    print(f"template load: {(time.perf_counter() - start) * 1e3:.1f}ms")
+
+    for shape, kwargs in SHAPES.items():
+        servers = gen_shape(args.n, **kwargs)
+
+        for name, bench, renderers in (
+            (
+                "wg_client",
+                bench_client,
+                (
+                    jinja_client,
+                    lambda server, client: fast.render(
+                        "wg_client.conf.j2", server, client
+                    ),
+                ),
+            ),
+            (
+                "wg_server",
+                bench_server,
+                (jinja_server, lambda server: fast.render("wg_server.conf.j2", server)),
+            ),
+        ):
+            rates = []
+
+            for render in renderers:
+                peers, elapsed = bench(servers, args.r, render)
+                rates.append(peers / elapsed)
+
+            print(
+                f"{shape:>20} {name}: jinja {rates[0]:.0f} peers/s, "
+                f"fast {rates[1]:.0f} peers/s, x{rates[1] / rates[0]:.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import genwg
+from genwg.loader import dump
+
+from .fleet import gen_fleet
+
+# argv, modules that must not get imported
+SCENARIOS = {
+    "help": (
+        ["--help"],
+        (
+            "yaml",
+            "jinja2",
+            "subprocess",
+            "secrets",
+            "ipaddress",
+            "hashlib",
+            "json",
+            "tempfile",
+            "concurrent.futures",
+            "genwg.config",
+            "genwg.keys",
+            "genwg.writer",
+        ),
+    ),
+    "apply": (
+        ["-c", "fleet.yml", "--apply", "--snapshot", "snapshot.txt", "--dry-run"],
+        ("jinja2", "genwg.genfiles", "tarfile", "zipfile"),
+    ),
+    "generate": (["-c", "fleet.yml", "-q"], ("tarfile", "zipfile")),
+}
+
+_RUNNER = """import sys
+modules_path = sys.argv[1]
+sys.argv = ["genwg", *sys.argv[2:]]
+from genwg.cli import run
+try:
+    run()
+except SystemExit:
+    pass
+modules = sorted(sys.modules)
+with open(modules_path, "w") as modules_file:
+    modules_file.write("\\n".join(modules))
+"""
+
+
+def run_scenario(tmp, argv, importtime=False):
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.path.dirname(os.path.dirname(genwg.__file__))
+    env["XDG_CACHE_HOME"] = os.path.join(tmp, "cache")
+
+    cmd = [sys.executable]
+    if importtime:
+        cmd += ["-X", "importtime"]
+    cmd += ["-c", _RUNNER, os.path.join(tmp, "modules.txt"), *argv]
+
+    start = time.perf_counter()
+    proc = subprocess.run(cmd, cwd=tmp, env=env, capture_output=True, check=False)
+    elapsed = time.perf_counter() - start
+
+    with open(os.path.join(tmp, "modules.txt"), "r", encoding="utf-8") as mod_file:
+        modules = set(mod_file.read().split("\n"))
+
+    return elapsed, proc.stderr.decode("utf-8"), modules
+
+
+def parse_importtime(stderr):
+    # "import time: self [us] | cumulative | imported package", indented by
+    # nesting depth. the self times of every line add up to the total.
+    total = 0
+    slowest = []
+
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+
+        own, cumulative, name = line[len("import time:") :].split("|")
+        total += int(own)
+        slowest.append((int(cumulative), name.strip()))
+
+    slowest.sort(reverse=True)
+
+    return total, slowest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="genwg startup benchmark")
+    parser.add_argument("-r", type=int, default=5, help="rounds, best one counts.")
+    parser.add_argument(
+        "-s",
+        dest="scenarios",
+        action="append",
+        choices=SCENARIOS.keys(),
+        help="scenario to run, can be repeated. all of them by default.",
+    )
+    parser.add_argument("--top", type=int, default=5, help="slowest imports shown.")
+    parser.add_argument(
+        "--max-ms",
+        type=float,
+        help="fail when the imports of a scenario take longer than this.",
+    )
+    args = parser.parse_args()
+
+    failed = False
+
+    with tempfile.TemporaryDirectory(prefix="genwg-startup-") as tmp:
+        with open(os.path.join(tmp, "fleet.yml"), "w", encoding="utf-8") as f:
+            f.write(dump(gen_fleet(clients=10)))
+
+        # no interfaces up, apply only gets as far as comparing
+        with open(os.path.join(tmp, "snapshot.txt"), "w", encoding="utf-8") as f:
+            f.write("")
+
+        for name in args.scenarios or SCENARIOS:
+            argv, forbidden = SCENARIOS[name]
+
+            wall = min(run_scenario(tmp, argv)[0] for _ in range(args.r))
+            _, stderr, modules = run_scenario(tmp, argv, importtime=True)
+            total, slowest = parse_importtime(stderr)
+
+            print(f"{name:>10}: {wall * 1e3:.0f}ms wall, {total / 1e3:.1f}ms imports")
+            for cumulative, module in slowest[: args.top]:
+                print(f"{'':>12}{cumulative / 1e3:6.1f}ms {module}")
+
+            imported = sorted(module for module in forbidden if module in modules)
+            if imported:
+                print(f"{'':>12}imported: {', '.join(imported)}")
+                failed = True
+
+            if args.max_ms is not None and total / 1e3 > args.max_ms:
+                print(f"{'':>12}over {args.max_ms:.0f}ms")
+                failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -61,6 +61,12 @@ for i in "${wgquick_path}" "${udp2raw_path}"; do
     fi
 done
 
+# v6 endpoints need brackets in front of a port
+case "${actual_endpoint}" in
+*:*) udp2raw_remote="[${actual_endpoint}]" ;;
+*) udp2raw_remote="${actual_endpoint}" ;;
+esac
+
 # set route vars
 default_route_line="$(ip route list match 0 table all scope global)"
 wan_gateway="$(echo "${default_route_line}" | awk '{print $3}')"
@@ -79,7 +85,7 @@ preup(){
     echo "I: starting udp2raw."
     "${udp2raw_path}" -c \
         -l 127.0.0.1:50001 \
-        -r "${actual_endpoint}":"${udp2raw_port}" \
+        -r "${udp2raw_remote}":"${udp2raw_port}" \
         -k "${udp2raw_pass}" -a \
         >>udp2raw.log 2>&1 &
 
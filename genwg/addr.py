@@ -0,0 +1,116 @@
+# address math for every client of a server at once, over plain ints instead
+# of an ipaddress object and a round of string splitting per client
+import ipaddress
+
+_OCTETS = tuple(str(octet) for octet in range(256))
+
+
+def v4_str(ip):
+    return (
+        f"{_OCTETS[ip >> 24]}.{_OCTETS[ip >> 16 & 255]}."
+        f"{_OCTETS[ip >> 8 & 255]}.{_OCTETS[ip & 255]}"
+    )
+
+
+def v4_ptr_zone(ip):
+    # reversed leading three octets, 10.1.2.3 -> 2.1.10
+    return f"{_OCTETS[ip >> 8 & 255]}.{_OCTETS[ip >> 16 & 255]}.{_OCTETS[ip >> 24]}"
+
+
+def v6_ptr(nibbles, zone_len):
+    # (zone, label) of the 32 hex digits of an address, both reversed
+    return ".".join(reversed(nibbles[:zone_len])), ".".join(
+        reversed(nibbles[zone_len:])
+    )
+
+
+class AddressBatch:
+    __slots__ = (
+        "version",
+        "rtype",
+        "ptr_suffix",
+        "ips",
+        "ip_strs",
+        "ptr_labels",
+        "ptr_zones",
+        "internal_ptr_zone",
+        "internal_ptr_label",
+    )
+
+    def __init__(self, network, ips):
+        internal_ip = int(network.network_address) + 1
+
+        self.version = network.version
+        self.ips = ips
+
+        if self.version == 4:
+            self.rtype = "A"
+            self.ptr_suffix = "in-addr.arpa"
+            self._v4(network, internal_ip)
+        else:
+            self.rtype = "AAAA"
+            self.ptr_suffix = "ip6.arpa"
+            self._v6(network, internal_ip)
+
+    def _v4(self, network, internal_ip):
+        # reverse zones are split on /24 boundaries no matter the prefix, so
+        # every PTR label is a single octet and a /16 ends up as up to 256
+        # zones that each stay small
+        ips = self.ips
+
+        self.ip_strs = [v4_str(ip) for ip in ips]
+        self.ptr_labels = [_OCTETS[ip & 255] for ip in ips]
+        self.internal_ptr_label = _OCTETS[internal_ip & 255]
+
+        # anything past a /24 shares its /24 with other subnets, it gets a
+        # zone of its own named the rfc 2317 way, 10.0.0.64/26 -> 64-26.0.0.10
+        if network.prefixlen > 24:
+            base = int(network.network_address)
+            zone = f"{_OCTETS[base & 255]}-{network.prefixlen}.{v4_ptr_zone(base)}"
+
+            self.internal_ptr_zone = zone
+            self.ptr_zones = {zone: list(range(len(ips)))}
+            return
+
+        self.internal_ptr_zone = v4_ptr_zone(internal_ip)
+
+        # zone -> indices of the clients within it, zones in address order
+        zones = {internal_ip >> 8: []}
+        for index, ip in enumerate(ips):
+            zones.setdefault(ip >> 8, []).append(index)
+
+        self.ptr_zones = {
+            v4_ptr_zone(key << 8): indices for key, indices in sorted(zones.items())
+        }
+
+    def _v6(self, network, internal_ip):
+        # reverse zones are cut on the first nibble boundary at or past the
+        # prefix, a /64 is a single zone with 16 nibble labels while a /62
+        # is split into four /64 zones. always leaves at least one nibble
+        # for the label.
+        zone_len = min(-(-network.prefixlen // 4), 31)
+
+        self.ip_strs = [str(ipaddress.IPv6Address(ip)) for ip in self.ips]
+        self.ptr_labels = []
+
+        self.internal_ptr_zone, self.internal_ptr_label = v6_ptr(
+            f"{internal_ip:032x}", zone_len
+        )
+
+        zones = {self.internal_ptr_zone: []}
+        keys = {self.internal_ptr_zone: f"{internal_ip:032x}"[:zone_len]}
+
+        for index, ip in enumerate(self.ips):
+            nibbles = f"{ip:032x}"
+            zone, label = v6_ptr(nibbles, zone_len)
+
+            self.ptr_labels.append(label)
+
+            if zone not in zones:
+                zones[zone] = []
+                keys[zone] = nibbles[:zone_len]
+
+            zones[zone].append(index)
+
+        # fixed width hex sorts the same as the addresses do
+        self.ptr_zones = {zone: zones[zone] for zone in sorted(zones, key=keys.get)}
@@ -0,0 +1,94 @@
+import bisect
+import ipaddress
+
+
+class PrefixExhaustedError(Exception):
+    pass
+
+
+class FreeIntervals:
+    # free host offsets as sorted, disjoint, inclusive [start, end] ranges.
+    # a freshly allocated prefix is a single range no matter how large it is.
+    def __init__(self, start, end):
+        self.starts = [start] if start <= end else []
+        self.ends = [end] if start <= end else []
+
+    def take(self, offset):
+        index = bisect.bisect_right(self.starts, offset) - 1
+
+        if index < 0 or offset > self.ends[index]:
+            return False
+
+        start, end = self.starts[index], self.ends[index]
+
+        if start == end:
+            del self.starts[index]
+            del self.ends[index]
+        elif offset == start:
+            self.starts[index] = offset + 1
+        elif offset == end:
+            self.ends[index] = offset - 1
+        else:
+            self.ends[index] = offset - 1
+            self.starts.insert(index + 1, offset + 1)
+            self.ends.insert(index + 1, end)
+
+        return True
+
+    def pop(self):
+        if not self.starts:
+            raise PrefixExhaustedError
+
+        offset = self.starts[0]
+        self.take(offset)
+
+        return offset
+
+
+class LeaseAllocator:
+    # hands out client addresses of a server, keeping the ones leased on
+    # previous runs and filling the gaps left by removed clients first
+    def __init__(self, network, leases=None):
+        self.network = network
+        self.base = int(network.network_address)
+
+        # .0 is the network, .1 the server and the last one the v4 broadcast
+        last = network.num_addresses - (2 if network.version == 4 else 1)
+        self.free = FreeIntervals(2, last)
+
+        self.leases = leases if isinstance(leases, dict) else {}
+
+    def _lease_offset(self, name):
+        # dual-stack clients lease one address per family
+        leased = self.leases.get(name)
+
+        if not isinstance(leased, list):
+            leased = [leased]
+
+        for address in leased:
+            try:
+                address = ipaddress.ip_address(address)
+            except ValueError:
+                continue
+
+            if address in self.network:
+                return int(address) - self.base
+
+        return None
+
+    def allocate(self, names):
+        # returns an address per name as an int, in order. leased names keep
+        # their addresses, everything else gets the lowest free one.
+        offsets = [None] * len(names)
+
+        for index, name in enumerate(names):
+            offset = self._lease_offset(name)
+
+            if offset is not None and self.free.take(offset):
+                offsets[index] = offset
+
+        for index, offset in enumerate(offsets):
+            if offset is None:
+                offsets[index] = self.free.pop()
+
+        return [self.base + offset for offset in offsets]
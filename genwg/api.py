@@ -0,0 +1,85 @@
+import logging
+
+import yaml
+
+from .config import ConfigYAML
+from .genfiles import GenFiles
+from .loader import compose, represent
+from .log import GenWGError, RaiseHandler
+from .writer import PendingWriter
+
+# errors raise GenWGError instead of exiting, records still propagate to
+# whatever the application set up for logging
+_LOGGER = logging.getLogger("genwg.api")
+_HANDLER = RaiseHandler()
+_LOGGER.addHandler(_HANDLER)
+
+
+def _compose(source, name):
+    if isinstance(source, dict):
+        try:
+            return represent(source)
+        except yaml.YAMLError as exc:
+            raise GenWGError(f"{name} cannot be represented as yaml: {exc}") from exc
+
+    try:
+        return compose(source)
+    except yaml.YAMLError as exc:
+        raise GenWGError(f"{name} parsing has failed: {exc}") from exc
+
+
+def load(
+    source,
+    name=None,
+    *,
+    key_backend=None,
+    jobs=1,
+    pool="thread",
+    key_cache=None,
+    leases=None,
+):
+    # source is either an already parsed configuration dict or a stream, or a
+    # string, of yaml. leases are those of a previous genwg-leases.yml, to keep
+    # client addresses stable. returns the parsed configuration, keys
+    # derived, without touching the filesystem.
+    name = name or getattr(source, "name", None) or "<config>"
+    _HANDLER.reset()
+
+    config = ConfigYAML(
+        name,
+        _LOGGER,
+        key_backend=key_backend,
+        jobs=jobs,
+        pool=pool,
+        key_cache=key_cache,
+        leases_file=None,
+    )
+    config.yaml_node = _compose(source, name)
+    config.leases = leases or {}
+    config.run()
+
+    return config
+
+
+def _artifacts(files):
+    for path, data in files:
+        try:
+            if not isinstance(data, str):
+                data = "".join(data)
+        except Exception as exc:
+            raise GenWGError(f"failed rendering {path}: {exc}") from exc
+
+        yield path, data.encode("utf-8")
+
+
+def generate(source, renderer="jinja", dumps=False, **kwargs):
+    # everything a run would write into genwg_dump as (path, bytes) pairs,
+    # paths relative to it. with dumps, the yaml and lease dumps come last.
+    # the configuration gets parsed and checked right away, jinja output is
+    # rendered as the pairs get consumed. takes the arguments of load() too.
+    config = load(source, **kwargs)
+
+    writer = PendingWriter()
+    GenFiles(config, _LOGGER, writer=writer, renderer=renderer).render(dumps=dumps)
+
+    return _artifacts(writer.files)
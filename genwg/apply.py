@@ -0,0 +1,195 @@
+import ipaddress
+import shlex
+import subprocess
+
+
+class WGApplyError(Exception):
+    pass
+
+
+def _allowed_ips(networks):
+    # wg prints the networks it was given in its own canonical form
+    return frozenset(
+        str(ipaddress.ip_network(network, strict=False))
+        for network in networks
+        if network
+    )
+
+
+class Interface:
+    __slots__ = ("name", "priv", "pub", "listen_port", "peers")
+
+    def __init__(self, name):
+        self.name = name
+        self.priv = None
+        self.pub = None
+        self.listen_port = None
+        self.peers = {}  # pub -> frozenset of allowed ips
+
+
+def parse_dump(text, name=None):
+    # `wg show <iface> dump` when name is given, `wg show all dump` otherwise,
+    # the latter prefixes every line with the interface name. tab separated,
+    # an interface line followed by one line per peer.
+    interfaces = {}
+
+    for line in text.splitlines():
+        if not line:
+            continue
+
+        fields = line.split("\t")
+
+        if name is None:
+            iface_name, fields = fields[0], fields[1:]
+        else:
+            iface_name = name
+
+        iface = interfaces.get(iface_name)
+
+        try:
+            if iface is None:
+                iface = interfaces[iface_name] = Interface(iface_name)
+                iface.priv, iface.pub, listen_port = fields[:3]
+                iface.listen_port = int(listen_port)
+            else:
+                allowed_ips = fields[3]
+                iface.peers[fields[0]] = (
+                    frozenset()
+                    if allowed_ips == "(none)"
+                    else _allowed_ips(allowed_ips.split(","))
+                )
+        except (IndexError, ValueError) as exc:
+            raise WGApplyError(f"malformed dump line: {line!r}") from exc
+
+    return interfaces
+
+
+class Delta:
+    # the minimal set of changes bringing an interface in line with a server
+    __slots__ = ("name", "listen_port", "added", "changed", "removed")
+
+    def __init__(self, server, iface):
+        self.name = server.name
+        self.listen_port = None
+        self.added = []  # (pub, allowed ips)
+        self.changed = []  # ^^^^^^^^^^^^^^^^^
+
+        if iface.listen_port != server.port:
+            self.listen_port = server.port
+
+        wanted = set()
+
+        for client in server.clients:
+            wanted.add(client.pub)
+
+            allowed_ips = _allowed_ips(
+                f"{client.address_str}{client.server_extra_allowed_str}".split(",")
+            )
+            current = iface.peers.get(client.pub)
+
+            if current is None:
+                self.added.append((client.pub, allowed_ips))
+            elif current != allowed_ips:
+                self.changed.append((client.pub, allowed_ips))
+
+        self.removed = [pub for pub in iface.peers if pub not in wanted]
+
+    def commands(self, wg_bin="wg", chunk_size=512):
+        # removals go first so that allowed ips moving between peers end up
+        # on the new owner. long deltas are split over several invocations to
+        # stay clear of the argument length limit.
+        args = []
+
+        if self.listen_port is not None:
+            args.append(["listen-port", str(self.listen_port)])
+
+        for pub in self.removed:
+            args.append(["peer", pub, "remove"])
+
+        for pub, allowed_ips in self.added + self.changed:
+            args.append(["peer", pub, "allowed-ips", ",".join(sorted(allowed_ips))])
+
+        return [
+            [wg_bin, "set", self.name]
+            + [arg for peer_args in args[i : i + chunk_size] for arg in peer_args]
+            for i in range(0, len(args), chunk_size)
+        ]
+
+
+class Apply:
+    def __init__(
+        self, config, parent_logger, *, wg_bin="wg", snapshot=None, dry_run=False
+    ):
+        self.servers = config.servers
+        self.logger = parent_logger.getChild(self.__class__.__name__)
+        self.wg_bin = wg_bin
+        self.snapshot = snapshot
+        self.dry_run = dry_run
+
+    def _run(self, args):
+        try:
+            proc = subprocess.run(args, check=True, capture_output=True)
+        except subprocess.CalledProcessError as exc:
+            raise WGApplyError(exc.stderr.decode("utf-8").rstrip("\n")) from exc
+        except OSError as exc:
+            raise WGApplyError(f"failed executing {self.wg_bin}: {exc}") from exc
+
+        return proc.stdout.decode("utf-8")
+
+    def _load_snapshot(self):
+        try:
+            with open(self.snapshot, "r", encoding="utf-8") as snapshot_file:
+                return parse_dump(snapshot_file.read())
+        except OSError:
+            self.logger.exception("failed reading %s", self.snapshot)
+        except WGApplyError as exc:
+            self.logger.error("%s: %s", self.snapshot, exc)
+
+    def _show(self, name):
+        try:
+            dump = self._run([self.wg_bin, "show", name, "dump"])
+            return parse_dump(dump, name).get(name)
+        except WGApplyError as exc:
+            self.logger.debug("%s: %s", name, exc)
+
+        return None
+
+    def run(self):
+        interfaces = self._load_snapshot() if self.snapshot else None
+
+        for server in self.servers:
+            if interfaces is None:
+                iface = self._show(server.name)
+            else:
+                iface = interfaces.get(server.name)
+
+            if iface is None:
+                self.logger.warning("%s is not up, skipping", server.name)
+                continue
+
+            if iface.pub != server.pub:
+                self.logger.warning(
+                    "%s is running with a different private key, "
+                    "it needs a restart to pick up the new one",
+                    server.name,
+                )
+
+            delta = Delta(server, iface)
+
+            self.logger.info(
+                "%s: %s added, %s changed, %s removed",
+                server.name,
+                len(delta.added),
+                len(delta.changed),
+                len(delta.removed),
+            )
+
+            for args in delta.commands(self.wg_bin):
+                if self.dry_run:
+                    print(shlex.join(args))
+                    continue
+
+                try:
+                    self._run(args)
+                except WGApplyError as exc:
+                    self.logger.error("%s: %s", server.name, exc)
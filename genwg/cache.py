@@ -0,0 +1,92 @@
+import hashlib
+import json
+import os
+
+
+def cache_dir():
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+
+    return os.path.join(base, "genwg")
+
+
+class PubKeyCache:
+    _FILENAME = "pubkeys.json"
+
+    def __init__(self, path=None, max_entries=100000):
+        self.path = path or os.path.join(cache_dir(), self._FILENAME)
+        self.max_entries = max_entries
+
+        # sha256(priv) -> pub, least recently used first. private keys
+        # themselves never hit the disk.
+        self.entries = {}
+        self.dirty = False
+        self.loaded = False
+
+    @staticmethod
+    def _digest(priv_key):
+        return hashlib.sha256(priv_key.encode("utf-8")).hexdigest()
+
+    def load(self):
+        # long running processes keep the entries around after the first load
+        if self.loaded:
+            return
+
+        self.loaded = True
+
+        try:
+            with open(self.path, "r", encoding="utf-8") as cache_file:
+                entries = json.load(cache_file)
+        except (OSError, ValueError):
+            return
+
+        if isinstance(entries, dict):
+            self.entries = entries
+
+    def get(self, priv_key):
+        digest = self._digest(priv_key)
+        pub_key = self.entries.pop(digest, None)
+
+        if pub_key is not None:
+            self.entries[digest] = pub_key
+
+        return pub_key
+
+    def put(self, priv_key, pub_key):
+        digest = self._digest(priv_key)
+
+        if self.entries.pop(digest, None) != pub_key:
+            self.dirty = True
+
+        self.entries[digest] = pub_key
+
+    def save(self):
+        if not self.dirty:
+            return
+
+        # evict the least recently used entries
+        overflow = len(self.entries) - self.max_entries
+        if overflow > 0:
+            for digest in list(self.entries)[:overflow]:
+                del self.entries[digest]
+
+        os.makedirs(os.path.dirname(self.path), mode=0o700, exist_ok=True)
+
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as cache_file:
+                json.dump(self.entries, cache_file, separators=(",", ":"))
+
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+            raise
+
+        self.dirty = False
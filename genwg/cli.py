@@ -1,9 +1,12 @@
 import argparse
 import logging
+import os
+import sys
 
+# everything else gets imported by the code paths that need it, so that
+# --help and runs that never render do not pay for yaml or jinja
 from . import __version__ as pkg_version
-from .config import ConfigYAML
-from .genfiles import GenFiles
+from .constants import ARCHIVE_FORMATS, KEY_BACKENDS, POOLS, RENDERERS
 from .log import set_root_logger
 
 
@@ -11,38 +14,362 @@ class CLI:
     def __init__(self):
         self.config_file = None
         self.debug = None
+        self.quiet = None
+        self.key_backend = None
+        self.jobs = None
+        self.pool = None
+        self.no_cache = None
+        self.incremental = None
+        self.stream = None
+        self.writers = None
+        self.shards = None
+        self.renderer = None
+        self.archive = None
+        self.archive_format = None
+        self.plan = None
+        self.apply = None
+        self.snapshot = None
+        self.dry_run = None
+        self.wg_bin = None
+        self.serve = None
+        self.metrics = None
+        self.interval = None
+        self.profile = None
+        self.cprofile = None
+        self.key_cache = None
+        self.profiler = None
         self.logger = None
 
     def _gen_args(self):
         parser_desc = f"wireguard config generator, ver. {pkg_version}"
         parser_c_help = "configuration file."
-        parser_d_help = "enable debugging."
+        parser_d_help = "enable debugging, with a line per peer and file."
+        parser_q_help = "only print warnings and errors."
+        parser_k_help = "key backend used for generating and deriving keys."
+        parser_j_help = "number of workers to derive keys with."
+        parser_pool_help = "worker pool type used for deriving keys."
+        parser_no_cache_help = "do not use the on-disk public key cache."
+        parser_i_help = "only rewrite the files whose inputs changed."
+        parser_stream_help = "parse the configuration one server at a time."
+        parser_w_help = "number of threads writing the generated files."
+        parser_shards_help = (
+            "number of processes parsing, deriving keys for and rendering "
+            "servers in parallel."
+        )
+        parser_renderer_help = (
+            "engine rendering the wireguard configurations, fast builds them "
+            "with plain string joins."
+        )
+        parser_o_help = "write a single archive instead of genwg_dump, - for stdout."
+        parser_archive_format_help = "archive format, guessed from -o by default."
+        parser_plan_help = (
+            "list the files a run would add, change or remove compared to an "
+            "output tree (genwg_dump by default) or a previous yaml dump, "
+            "without writing anything. exits with 2 if there are changes."
+        )
+        parser_apply_help = (
+            "sync the running interfaces of the servers with wg set instead of "
+            "writing files."
+        )
+        parser_snapshot_help = "read interface state from a saved wg show all dump."
+        parser_dry_run_help = "print the wg set commands --apply would run."
+        parser_wg_help = "path to the wg binary."
+        parser_profile_help = (
+            "write per phase timings, peak rss and counts as json, - for stdout."
+        )
+        parser_cprofile_help = "write cProfile stats of the run to a file."
+        parser_serve_help = (
+            "keep running, regenerating the files whenever the configuration "
+            "changes."
+        )
+        parser_metrics_help = "write reload latency metrics to a json file."
+        parser_interval_help = (
+            "seconds between configuration checks when inotify is unavailable."
+        )
 
         parser = argparse.ArgumentParser(description=parser_desc)
         parser.add_argument("-c", type=str, required=True, help=parser_c_help)
-        parser.add_argument("-d", dest="debug", action="store_true", help=parser_d_help)
+        verbosity = parser.add_mutually_exclusive_group()
+        verbosity.add_argument(
+            "-d", dest="debug", action="store_true", help=parser_d_help
+        )
+        verbosity.add_argument(
+            "-q", dest="quiet", action="store_true", help=parser_q_help
+        )
+        parser.add_argument(
+            "-k",
+            dest="key_backend",
+            choices=KEY_BACKENDS,
+            default="x25519",
+            help=parser_k_help,
+        )
+        parser.add_argument("-j", dest="jobs", type=int, default=1, help=parser_j_help)
+        parser.add_argument(
+            "--pool",
+            choices=POOLS.keys(),
+            default="process",
+            help=parser_pool_help,
+        )
+        parser.add_argument(
+            "--no-cache",
+            dest="no_cache",
+            action="store_true",
+            help=parser_no_cache_help,
+        )
+        parser.add_argument(
+            "-i", dest="incremental", action="store_true", help=parser_i_help
+        )
+        parser.add_argument(
+            "--stream", dest="stream", action="store_true", help=parser_stream_help
+        )
+        parser.add_argument(
+            "-w", dest="writers", type=int, default=4, help=parser_w_help
+        )
+        parser.add_argument(
+            "--shards", dest="shards", type=int, default=1, help=parser_shards_help
+        )
+        parser.add_argument(
+            "--renderer",
+            dest="renderer",
+            choices=RENDERERS,
+            default="jinja",
+            help=parser_renderer_help,
+        )
+        output = parser.add_mutually_exclusive_group()
+        output.add_argument("-o", dest="archive", type=str, help=parser_o_help)
+        output.add_argument(
+            "--plan",
+            dest="plan",
+            nargs="?",
+            const="genwg_dump",
+            metavar="TARGET",
+            help=parser_plan_help,
+        )
+        output.add_argument(
+            "--apply", dest="apply", action="store_true", help=parser_apply_help
+        )
+        output.add_argument(
+            "--serve", dest="serve", action="store_true", help=parser_serve_help
+        )
+        parser.add_argument("--metrics", type=str, help=parser_metrics_help)
+        parser.add_argument(
+            "--interval", type=float, default=1.0, help=parser_interval_help
+        )
+        parser.add_argument("--profile", type=str, help=parser_profile_help)
+        parser.add_argument("--cprofile", type=str, help=parser_cprofile_help)
+        parser.add_argument("--snapshot", type=str, help=parser_snapshot_help)
+        parser.add_argument(
+            "--dry-run", dest="dry_run", action="store_true", help=parser_dry_run_help
+        )
+        parser.add_argument("--wg", dest="wg_bin", default="wg", help=parser_wg_help)
+        parser.add_argument(
+            "--archive-format",
+            dest="archive_format",
+            choices=ARCHIVE_FORMATS,
+            help=parser_archive_format_help,
+        )
         args = parser.parse_args()
 
         self.config_file = args.c
         self.debug = args.debug
+        self.quiet = args.quiet
+        self.key_backend = args.key_backend
+        self.jobs = args.jobs
+        self.pool = args.pool
+        self.no_cache = args.no_cache
+        self.incremental = args.incremental
+        self.stream = args.stream
+        self.writers = args.writers
+        self.shards = args.shards
+        self.renderer = args.renderer
+        self.archive = args.archive
+        self.archive_format = args.archive_format
+        self.plan = args.plan
+        self.apply = args.apply
+        self.snapshot = args.snapshot
+        self.dry_run = args.dry_run
+        self.wg_bin = args.wg_bin
+        self.serve = args.serve
+        self.metrics = args.metrics
+        self.interval = args.interval
+        self.profile = args.profile
+        self.cprofile = args.cprofile
+
+    def _new_config(self, config_file, stream=False, leases_file=None):
+        from .config import ConfigYAML
+        from .keys import get_backend
+
+        return ConfigYAML(
+            config_file,
+            self.logger,
+            key_backend=get_backend(self.key_backend, self.wg_bin),
+            jobs=self.jobs,
+            pool=self.pool,
+            key_cache=self.key_cache,
+            stream=stream,
+            leases_file=leases_file or ConfigYAML.LEASES_FILE,
+            profiler=self.profiler,
+        )
+
+    def _load_config(self, config_file, stream=False, leases_file=None):
+        config = self._new_config(config_file, stream, leases_file)
+        config.run()
+
+        return config
 
     def run(self):
         # parse args
         self._gen_args()
 
         # create root logger and init our own
-        set_root_logger(self.debug)
+        set_root_logger(self.debug, self.quiet)
         self.logger = logging.getLogger("genwg")
 
         # action
         self.logger.info("started genwg ver. %s", pkg_version)
 
+        # checked before anything runs, a failed check would still save it
+        if self.profile == "-" and (self.archive == "-" or self.plan):
+            self.logger.error("--profile - cannot share stdout with -o - or --plan")
+
+        from .profiling import NULL_PROFILER, Profiler
+
+        self.profiler = Profiler() if self.profile else NULL_PROFILER
+
+        profile = None
+        if self.cprofile:
+            import cProfile
+
+            profile = cProfile.Profile()
+            profile.enable()
+
+        try:
+            self._action()
+        finally:
+            if profile:
+                profile.disable()
+                profile.dump_stats(self.cprofile)
+
+            if self.profile:
+                try:
+                    self.profiler.save(
+                        self.profile, version=pkg_version, config=self.config_file
+                    )
+                except OSError as exc:
+                    self.logger.warning("failed saving the profile: %s", exc)
+
+    def _action(self):
+        # later runs load the compiled templates instead of compiling them
+        from .render import enable_bytecode_cache
+
+        enable_bytecode_cache()
+
+        # shared by every load, stays resident in serve mode
+        if not self.no_cache:
+            from .cache import PubKeyCache
+
+            self.key_cache = PubKeyCache()
+
+        if self.shards > 1 and any(
+            (self.serve, self.plan, self.apply, self.archive, self.stream)
+        ):
+            self.logger.error("--shards only applies to writing genwg_dump")
+
+        # watch and regenerate until stopped
+        if self.serve:
+            from .serve import Serve
+
+            # the whole configuration stays in memory between reloads anyway
+            if self.stream:
+                self.logger.warning("--stream does not apply to --serve, ignoring")
+
+            Serve(
+                self.config_file,
+                self.logger,
+                self._new_config,
+                writers=self.writers,
+                metrics_file=self.metrics,
+                interval=self.interval,
+                renderer=self.renderer,
+            ).run()
+            return
+
+        # parse, derive keys and render servers in worker processes
+        if self.shards > 1:
+            from .keys import get_backend
+            from .shard import Shards
+
+            Shards(
+                self.config_file,
+                self.logger,
+                self.shards,
+                key_backend=get_backend(self.key_backend, self.wg_bin),
+                jobs=self.jobs,
+                pool=self.pool,
+                key_cache=self.key_cache,
+                incremental=self.incremental,
+                writers=self.writers,
+                renderer=self.renderer,
+                profiler=self.profiler,
+            ).run()
+            return
+
+        # a plan compares against TARGET, client addresses come from the
+        # leases next to it
+        leases_file = None
+        if self.plan:
+            leases_dir = self.plan
+            if not os.path.isdir(leases_dir):
+                leases_dir = os.path.dirname(leases_dir)
+
+            leases_file = os.path.join(leases_dir, "genwg-leases.yml")
+
         # parse yaml
-        config = ConfigYAML(self.config_file, self.logger)
-        config.run()
+        config = self._load_config(self.config_file, self.stream, leases_file)
+
+        # compare instead of writing
+        if self.plan:
+            from .plan import Plan
+
+            baseline = None
+            if os.path.isfile(self.plan):
+                baseline = self._load_config(self.plan, leases_file=leases_file)
+
+            plan = Plan(
+                config,
+                self.logger,
+                self.plan,
+                baseline=baseline,
+                renderer=self.renderer,
+            )
+            sys.exit(2 if plan.run() else 0)
+
+        # sync running interfaces instead of writing
+        if self.apply:
+            from .apply import Apply
+
+            Apply(
+                config,
+                self.logger,
+                wg_bin=self.wg_bin,
+                snapshot=self.snapshot,
+                dry_run=self.dry_run,
+            ).run()
+            return
 
         # generate files
-        genfiles = GenFiles(config, self.logger)
+        from .genfiles import GenFiles
+
+        genfiles = GenFiles(
+            config,
+            self.logger,
+            incremental=self.incremental,
+            writers=self.writers,
+            archive=self.archive,
+            archive_format=self.archive_format,
+            renderer=self.renderer,
+            profiler=self.profiler,
+        )
         genfiles.run()
 
 
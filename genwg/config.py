@@ -1,29 +1,72 @@
 import ipaddress
+import itertools
+import logging
 import os
 import re
-import secrets
-import subprocess
 
 import yaml
 
-from .log import ANSIColors
+from .addr import AddressBatch
+from .alloc import LeaseAllocator, PrefixExhaustedError
+from .keys import WGKeyError, X25519Backend, derive_keys
+from .loader import compose, construct, iter_nodes, iter_sequence, load
+from .log import ANSIColors, Progress
+from .profiling import NULL_PROFILER
+from .validate import Validator, is_fqdn
 
 ac = ANSIColors()
 
 
+def _gen_secret():
+    import secrets
+
+    return secrets.token_urlsafe(12)
+
+
+def _join_networks(networks):
+    return "".join(f",{network}" for network in networks)
+
+
 class UDP2RAW:
+    __slots__ = ("port", "secret")
+
     def __init__(self):
         self.port = None
         self.secret = None
 
 
 class Named:
+    __slots__ = ("hostname", "conf_dir")
+
     def __init__(self):
         self.hostname = None
         self.conf_dir = None
 
 
 class Server:
+    __slots__ = (
+        "name",
+        "priv",
+        "ip",
+        "port",
+        "net",
+        "pfx",
+        "net6",
+        "pfx6",
+        "udp2raw",
+        "mtu",
+        "named",
+        "clients",
+        "extra_allowed",
+        "extra_address",
+        "pub",
+        "internal_ip",
+        "internal_ip6",
+        "ip_is_fqdn",
+        "addresses",
+        "addresses6",
+    )
+
     def __init__(self):
         # from yaml
         self.name = None
@@ -32,22 +75,139 @@ class Server:
         self.port = None
         self.net = None  # net key from yaml gets split for ease: {net}/{pfx}
         self.pfx = None  # ^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^^
+        self.net6 = None  # v6 subnet of a dual-stack server, split the same way
+        self.pfx6 = None
         self.udp2raw = None
         self.mtu = None
         self.named = None
         self.clients = []
-        self.extra_allowed = []
+        self.extra_allowed = {}  # ip_network -> None, an insertion ordered set
+        self.extra_address = []  # ip_network's
 
         # internal
         self.pub = None
         self.internal_ip = None
-        self.last_ip = None
-        self.ptr = None
-        self.extra_address_str = ""
+        self.internal_ip6 = None
         self.ip_is_fqdn = None
+        self.addresses = None  # AddressBatch of the clients
+        self.addresses6 = None  # ^^^^^^^^^^^^^^^^^^^^^^^^^^^ over net6
+
+    @property
+    def _batches(self):
+        if self.addresses6 is None:
+            return (self.addresses,)
+
+        return (self.addresses, self.addresses6)
+
+    @property
+    def extra_address_str(self):
+        return _join_networks(self.extra_address)
+
+    # ip of the server where a port follows it, v6 addresses in brackets
+    @property
+    def endpoint_ip(self):
+        if isinstance(self.ip, ipaddress.IPv6Address):
+            return f"[{self.ip}]"
+
+        return str(self.ip)
+
+    # Address of the server peer
+    @property
+    def address_str(self):
+        address = f"{self.internal_ip}/{self.pfx}"
+
+        if self.net6 is not None:
+            address += f",{self.internal_ip6}/{self.pfx6}"
+
+        return address + self.extra_address_str
+
+    # AllowedIPs of the server in the client peer configurations
+    @property
+    def default_allowed(self):
+        if self.net6 is not None:
+            return "0.0.0.0/0,::/0"
+
+        return "0.0.0.0/0" if self.net.version == 4 else "::/0"
+
+    # (name, type, address) of the server and every client for the A zone
+    @property
+    def a_records(self):
+        batches = self._batches
+        names = [client.name for client in self.clients]
+
+        for batch, internal_ip in zip(batches, (self.internal_ip, self.internal_ip6)):
+            yield self.named.hostname, batch.rtype, internal_ip
+
+        if len(batches) == 1:
+            yield from zip(
+                names, itertools.repeat(batches[0].rtype), batches[0].ip_strs
+            )
+            return
+
+        for name, ip, ip6 in zip(names, batches[0].ip_strs, batches[1].ip_strs):
+            yield name, "A", ip
+            yield name, "AAAA", ip6
+
+    # reverse zones the server and its clients live in, /24's for v4
+    @property
+    def ptr_zones(self):
+        return [zone for batch in self._batches for zone in batch.ptr_zones]
+
+    # (zone, origin) of every reverse zone
+    @property
+    def ptr_origins(self):
+        return [
+            (zone, f"{zone}.{batch.ptr_suffix}")
+            for batch in self._batches
+            for zone in batch.ptr_zones
+        ]
+
+    def _ptr_batch(self, zone):
+        for batch in self._batches:
+            if zone in batch.ptr_zones:
+                return batch
+
+        raise KeyError(zone)
+
+    def ptr_zone_clients(self, zone):
+        batch = self._ptr_batch(zone)
+
+        return (self.clients[index] for index in batch.ptr_zones[zone])
+
+    # (label, name) of the server, if it is in there, and every client in the
+    # given PTR zone
+    def ptr_records(self, zone):
+        batch = self._ptr_batch(zone)
+
+        if zone == batch.internal_ptr_zone:
+            yield batch.internal_ptr_label, self.named.hostname
+
+        labels = batch.ptr_labels
+
+        for index in batch.ptr_zones[zone]:
+            yield labels[index], self.clients[index].name
 
 
 class Client:
+    __slots__ = (
+        "name",
+        "priv",
+        "wg_handled_dns",
+        "android",
+        "wgquick_path",
+        "udp2raw_path",
+        "udp2raw_log_path",
+        "bind",
+        "root_zone_file",
+        "append_extra",
+        "extra_allowed",
+        "ip",
+        "ip6",
+        "host_bit",
+        "pub",
+        "client_extra_allowed",
+    )
+
     def __init__(self):
         # from yaml
         self.name = None
@@ -60,55 +220,166 @@ class Client:
         self.bind = False
         self.root_zone_file = None
         self.append_extra = False
-        self.extra_allowed = []
+        self.extra_allowed = []  # ip_network's
 
         # internal
         self.ip = None
+        self.ip6 = None  # only on dual-stack servers
         self.host_bit = None
         self.pub = None
-        self.server_extra_allowed_str = ""
-        self.client_extra_allowed_str = ""
+        self.client_extra_allowed = []  # ip_network's, shared between clients
+
+    # Address of the client peer
+    @property
+    def address_str(self):
+        address = f"{self.ip}/{self.ip.max_prefixlen}"
+
+        if self.ip6 is not None:
+            address += f",{self.ip6}/128"
+
+        return address
+
+    # AllowedIPs of the client in the server peer configuration
+    @property
+    def server_extra_allowed_str(self):
+        return _join_networks(self.extra_allowed)
+
+    # AllowedIPs of the server in the client peer configuration
+    @property
+    def client_extra_allowed_str(self):
+        return _join_networks(self.client_extra_allowed)
 
 
 class ConfigYAML:
-    def __init__(self, config_file, parent_logger):
+    LEASES_FILE = "genwg_dump/genwg-leases.yml"
+
+    def __init__(
+        self,
+        config_file,
+        parent_logger,
+        *,
+        key_backend=None,
+        jobs=1,
+        pool="process",
+        key_cache=None,
+        stream=False,
+        leases_file=LEASES_FILE,
+        profiler=NULL_PROFILER,
+    ):
         self.config_file = config_file
         self.logger = parent_logger.getChild(self.__class__.__name__)
-
+        self.key_backend = key_backend or X25519Backend()
+        self.jobs = jobs
+        self.pool = pool
+        self.key_cache = key_cache
+        self.stream = stream
+        self.leases_file = leases_file
+        self.profiler = profiler
+
+        self.leases = {}
+        self.keys_cached = 0
+        self.keys_derived = 0
+        self._networks = {}
+
+        self.yaml_node = None
         self.yaml_parsed = None
         self.servers = []
 
     def _load_yaml(self):
         self.logger.info("loading configuration")
 
-        if os.path.isfile(self.config_file):
+        # composed already, e.g. by the library api
+        if self.yaml_node is not None:
+            return
+
+        if not os.path.isfile(self.config_file):
+            self.logger.error("%s is not a file", self.config_file)
+
+        # servers get parsed one by one as parse_yaml() asks for them
+        if self.stream:
+            return
+
+        try:
+            with open(self.config_file, "r", encoding="utf-8") as yaml_file:
+                self.yaml_node = compose(yaml_file)
+        except:
+            self.logger.exception("%s parsing has failed", self.config_file)
+
+    def _validate(self):
+        # everything is checked up front and reported at once, before any
+        # expensive work happens
+        self.logger.info("validating configuration")
+
+        validator = Validator(self.config_file, self.logger)
+
+        if self.stream:
             try:
                 with open(self.config_file, "r", encoding="utf-8") as yaml_file:
-                    self.yaml_parsed = yaml.load(yaml_file.read(), Loader=yaml.Loader)
-            except:
+                    validator.validate_servers(iter_nodes(yaml_file, "servers"))
+            except KeyError:
+                validator.validate_document(None)
+            except (OSError, yaml.YAMLError):
                 self.logger.exception("%s parsing has failed", self.config_file)
         else:
-            self.logger.error("%s is not a file", self.config_file)
+            validator.validate_document(self.yaml_node)
+
+        validator.finish()
 
-    def _gen_wg_priv(self):
+        if not self.stream:
+            self.yaml_parsed = construct(self.yaml_node)
+            self.yaml_node = None
+
+    def _stream_servers(self):
         try:
-            proc = subprocess.run(["wg", "genkey"], check=True, capture_output=True)
-        except subprocess.CalledProcessError as exc:
-            self.logger.error("%s", exc.stderr.decode("utf-8"))
+            with open(self.config_file, "r", encoding="utf-8") as yaml_file:
+                yield from iter_sequence(yaml_file, "servers")
+        except KeyError:
+            self.logger.error("servers section in the YAML file is missing")
+        except (OSError, yaml.YAMLError):
+            self.logger.exception("%s parsing has failed", self.config_file)
 
-        return proc.stdout.decode("utf-8").rstrip("\n")
+    def _load_leases(self):
+        if not self.leases_file or not os.path.isfile(self.leases_file):
+            return
 
-    def _gen_wg_pub(self, priv_key):
-        priv_key = f"{priv_key}\n".encode("utf-8")
+        try:
+            with open(self.leases_file, "r", encoding="utf-8") as leases_file:
+                leases = load(leases_file)
+        except:
+            self.logger.exception("%s parsing has failed", self.leases_file)
+
+        if isinstance(leases, dict):
+            self.leases = leases
+
+    def _allocate_batch(self, server, net, pfx):
+        # offsets into the prefix are plain ints, a /64 costs the same as a /24
+        network = ipaddress.ip_network(f"{net}/{pfx}")
+        allocator = LeaseAllocator(network, self.leases.get(server.name))
 
         try:
-            proc = subprocess.run(
-                ["wg", "pubkey"], input=priv_key, check=True, capture_output=True
+            ips = allocator.allocate([client.name for client in server.clients])
+        except PrefixExhaustedError:
+            self.logger.error(
+                "%s/%s has no room for %s clients", net, pfx, len(server.clients)
             )
-        except subprocess.CalledProcessError as exc:
-            self.logger.error("%s", exc.stderr.decode("utf-8"))
 
-        return proc.stdout.decode("utf-8").rstrip("\n")
+        return AddressBatch(network, ips)
+
+    def _allocate(self, server):
+        server.addresses = self._allocate_batch(server, server.net, server.pfx)
+        address_class = type(server.net)
+
+        for client, ip, ptr_label in zip(
+            server.clients, server.addresses.ips, server.addresses.ptr_labels
+        ):
+            client.ip = address_class(ip)
+            client.host_bit = ptr_label
+
+        if server.net6 is not None:
+            server.addresses6 = self._allocate_batch(server, server.net6, server.pfx6)
+
+            for client, ip in zip(server.clients, server.addresses6.ips):
+                client.ip6 = ipaddress.IPv6Address(ip)
 
     def _check_port(self, port):
         try:
@@ -121,30 +392,34 @@ class ConfigYAML:
 
         return port
 
-    @staticmethod
-    def _is_fqdn(string):
-        fqdn_regex = r"^([a-zA-Z0-9]([a-zA-Z0-9\-]{0,61}[a-zA-Z0-9])?\.)+[a-zA-Z]{2,}$"
-        return bool(re.match(fqdn_regex, string)) and len(string) <= 253
+    def _ip_network(self, network):
+        # the same routes tend to repeat across every client of a server. the
+        # cache only lives as long as a parse, and holds the very networks
+        # the parsed servers point to anyway.
+        try:
+            return self._networks[network]
+        except KeyError:
+            ip_network = self._networks[network] = ipaddress.ip_network(network)
 
-    @staticmethod
-    def _get_host_bits(ip, prefix):
-        netmask = str(ipaddress.ip_network(f"{ip}/{prefix}", strict=False).netmask)
+        return ip_network
 
-        ip_split = list(map(int, str(ip).split(".")))
-        netmask_split = list(map(int, netmask.split(".")))
+    @staticmethod
+    def _is_fqdn(string):
+        return is_fqdn(string)
 
-        host_bits = [
-            ip_split & (255 - netmask_split)
-            for ip_split, netmask_split in zip(ip_split, netmask_split)
-        ]
+    def parse_yaml(self):
+        self._networks = {}
 
-        return ".".join([str(bit) for bit in host_bits if bit != 0])
+        if self.stream:
+            servers = self._stream_servers()
+        else:
+            try:
+                servers = self.yaml_parsed["servers"]
+            except (KeyError, TypeError):
+                self.logger.error("servers section in the YAML file is missing")
 
-    def _parse_yaml(self):
-        try:
-            servers = self.yaml_parsed["servers"]
-        except KeyError:
-            self.logger.error("servers section in the YAML file is missing")
+        # per client lines only under -d, without even creating the records
+        peer_debug = self.logger.isEnabledFor(logging.DEBUG)
 
         # - - servers - - #
         for server_yaml in servers:
@@ -178,10 +453,7 @@ class ConfigYAML:
 
                 server.priv = server_yaml["priv"]
             except KeyError:
-                server.priv = self._gen_wg_priv()
-
-            # server.pub
-            server.pub = self._gen_wg_pub(server.priv)
+                pass
 
             # server.ip
             try:
@@ -210,14 +482,30 @@ class ConfigYAML:
             # server.pfx
             server.pfx = yaml_net.prefixlen
 
-            if server.pfx == 32:
-                self.logger.error("net prefix length cannot be 32")
+            if server.pfx == yaml_net.max_prefixlen:
+                self.logger.error("net prefix length cannot be %s", server.pfx)
 
             # server.internal_ip
             server.internal_ip = server.net + 1
 
-            # server.last_ip
-            server.last_ip = server.net + 1
+            # server.net6 + server.pfx6
+            if "net6" in server_yaml.keys():
+                if server.net.version == 6:
+                    self.logger.error("net6 requires net to be a v4 subnet")
+
+                try:
+                    yaml_net6 = ipaddress.IPv6Network(server_yaml["net6"])
+                except ValueError:
+                    self.logger.error("invalid net6")
+
+                server.net6 = yaml_net6.network_address
+                server.pfx6 = yaml_net6.prefixlen
+
+                if server.pfx6 == 128:
+                    self.logger.error("net6 prefix length cannot be 128")
+
+                # server.internal_ip6
+                server.internal_ip6 = server.net6 + 1
 
             # server.udp2raw
             if "udp2raw" in server_yaml.keys():
@@ -242,11 +530,11 @@ class ConfigYAML:
                 # server.udp2raw.secret
                 try:
                     if not server_yaml["udp2raw"]["secret"]:
-                        server.udp2raw.secret = secrets.token_urlsafe(12)
+                        server.udp2raw.secret = _gen_secret()
                     else:
                         server.udp2raw.secret = server_yaml["udp2raw"]["secret"]
                 except KeyError:
-                    server.udp2raw.secret = secrets.token_urlsafe(12)
+                    server.udp2raw.secret = _gen_secret()
 
             # server.mtu
             try:
@@ -285,23 +573,18 @@ class ConfigYAML:
                 # server.named.named_conf_dir
                 server.named.conf_dir = server_yaml["named"]["conf_dir"]
 
-                # server.ptr
-                server.ptr = re.sub(
-                    rf"^0/{server.pfx}\.|\.in\-addr\.arpa",
-                    "",
-                    str(yaml_net.reverse_pointer),
-                )
-
-            # server.extra_address_str
+            # server.extra_address
             try:
                 for address in server_yaml["extra_address"]:
                     try:
-                        if ipaddress.ip_network(address).prefixlen != 32:
-                            self.logger.error("%s is not a /32", address)
+                        address = ipaddress.ip_network(address)
                     except ValueError:
                         self.logger.error("invalid ip address: %s", address)
 
-                    server.extra_address_str += f",{address}"
+                    if address.prefixlen != address.max_prefixlen:
+                        self.logger.error("%s is not a /32 or a /128", address)
+
+                    server.extra_address.append(address)
             except TypeError:
                 self.logger.error("extra_address cannot be blank")
             except KeyError:
@@ -311,20 +594,26 @@ class ConfigYAML:
             try:
                 for network in server_yaml["extra_allowed"]:
                     try:
-                        network = ipaddress.ip_network(network)
+                        network = self._ip_network(network)
                     except ValueError:
                         self.logger.error("invalid network: %s", network)
 
-                    if network.prefixlen == 32:
-                        self.logger.error("extra_allowed items cannot be /32's")
+                    if network.prefixlen == network.max_prefixlen:
+                        self.logger.error(
+                            "extra_allowed items cannot be /32's or /128's"
+                        )
 
-                    server.extra_allowed.append(str(network))
+                    server.extra_allowed[network] = None
             except TypeError:
                 self.logger.error("extra_allowed cannot be blank")
             except KeyError:
                 pass
 
             # - - clients - - #
+            progress = Progress(
+                self.logger, f"{server.name} clients", len(server_yaml["clients"])
+            )
+
             for client_yaml in server_yaml["clients"]:
                 client = Client()
 
@@ -335,7 +624,8 @@ class ConfigYAML:
                     if not client.name:
                         self.logger.error("name cannot be blank")
 
-                    self.logger.info(" - %s", client.name)
+                    if peer_debug:
+                        self.logger.debug(" - %s", client.name)
                 except KeyError:
                     self.logger.error("name is missing from the client YAML")
 
@@ -347,13 +637,6 @@ class ConfigYAML:
                             "%s cannot be used as a subdomain", client.name
                         )
 
-                # client.ip
-                client.ip = server.last_ip + 1
-                server.last_ip += 1
-
-                # client.host_bit
-                client.host_bit = self._get_host_bits(client.ip, server.pfx)
-
                 # client.udp2raw_log_path
                 if server.udp2raw:
                     try:
@@ -373,10 +656,7 @@ class ConfigYAML:
 
                     client.priv = client_yaml["priv"]
                 except KeyError:
-                    client.priv = self._gen_wg_priv()
-
-                # client.pub
-                client.pub = self._gen_wg_pub(client.priv)
+                    pass
 
                 # client.wg_handled_dns
                 try:
@@ -446,23 +726,23 @@ class ConfigYAML:
                 except KeyError:
                     pass
 
-                if client.append_extra:
-                    client.client_extra_allowed_str += server.extra_address_str
-
                 # client.extra_allowed
                 try:
+                    client_networks = set()
+
                     for network in client_yaml["extra_allowed"]:
                         try:
-                            if ipaddress.ip_network(network):
-                                pass
+                            network = self._ip_network(network)
                         except ValueError:
                             self.logger.error("invalid network: %s", network)
 
+                        if network in client_networks:
+                            continue
+
+                        client_networks.add(network)
                         client.extra_allowed.append(network)
-                        client.server_extra_allowed_str += f",{network}"
 
-                        if network not in server.extra_allowed:
-                            server.extra_allowed.append(network)
+                        server.extra_allowed.setdefault(network, None)
                 except TypeError:
                     self.logger.error("extra_allowed cannot be blank.")
                 except KeyError:
@@ -470,14 +750,102 @@ class ConfigYAML:
 
                 # append
                 server.clients.append(client)
+                progress.step()
+
+            progress.done()
+
+            # client.ip + client.host_bit
+            self._allocate(server)
+
+            # clients without networks of their own all share the same list
+            extra_allowed = list(server.extra_allowed)
+            extra_allowed_appended = server.extra_address + extra_allowed
 
             for client in server.clients:
-                for network in server.extra_allowed:
-                    if network not in client.extra_allowed:
-                        client.client_extra_allowed_str += f",{str(network)}"
+                if client.extra_allowed:
+                    client_networks = set(client.extra_allowed)
+                    client.client_extra_allowed = [
+                        network
+                        for network in extra_allowed
+                        if network not in client_networks
+                    ]
+
+                    if client.append_extra:
+                        client.client_extra_allowed[:0] = server.extra_address
+                elif client.append_extra:
+                    client.client_extra_allowed = extra_allowed_appended
+                else:
+                    client.client_extra_allowed = extra_allowed
 
             self.servers.append(server)
 
-    def run(self):
-        self._load_yaml()
-        self._parse_yaml()
+    def derive_keys(self):
+        self.logger.info("deriving keys")
+
+        peers = []
+        for server in self.servers:
+            peers.append(server)
+            peers.extend(server.clients)
+
+        # public keys of known private keys come from the cache
+        if self.key_cache:
+            self.key_cache.load()
+
+            for peer in peers:
+                if peer.priv is not None:
+                    peer.pub = self.key_cache.get(peer.priv)
+
+        pending = [peer for peer in peers if peer.pub is None]
+        self.keys_cached = len(peers) - len(pending)
+        self.keys_derived = len(pending)
+
+        self.logger.info("%s cached, %s to derive", self.keys_cached, self.keys_derived)
+        self.profiler.count("keys_cached", self.keys_cached)
+        self.profiler.count("keys_derived", self.keys_derived)
+
+        try:
+            keys = derive_keys(
+                self.key_backend,
+                [peer.priv for peer in pending],
+                jobs=self.jobs,
+                pool=self.pool,
+            )
+        except WGKeyError as exc:
+            self.logger.error("%s", exc)
+
+        for peer, (priv, pub) in zip(pending, keys):
+            peer.priv = priv
+            peer.pub = pub
+
+        if self.key_cache:
+            for peer in pending:
+                self.key_cache.put(peer.priv, peer.pub)
+
+            try:
+                self.key_cache.save()
+            except OSError as exc:
+                self.logger.warning("failed saving the key cache: %s", exc)
+
+    def count_peers(self):
+        clients = sum(len(server.clients) for server in self.servers)
+        self.profiler.count("servers", len(self.servers))
+        self.profiler.count("clients", clients)
+        self.profiler.count("peers", len(self.servers) + clients)
+
+    def run(self, parse=True):
+        steps = [
+            ("load_leases", self._load_leases),
+            ("load_yaml", self._load_yaml),
+            ("validate", self._validate),
+        ]
+
+        # sharded runs parse and derive keys in the worker processes
+        if parse:
+            steps += [("parse", self.parse_yaml), ("derive_keys", self.derive_keys)]
+
+        for name, step in steps:
+            with self.profiler.phase(name):
+                step()
+
+        if parse:
+            self.count_peers()
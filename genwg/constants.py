@@ -0,0 +1,14 @@
+# choices the cli offers, kept apart from the modules implementing them and
+# free of imports, so that parsing arguments does not pull those in
+
+# key backends, implemented by keys.BACKENDS
+KEY_BACKENDS = ("x25519", "wg")
+
+# executor classes by name, concurrent.futures only imports them on first use
+POOLS = {
+    "thread": "ThreadPoolExecutor",
+    "process": "ProcessPoolExecutor",
+}
+
+RENDERERS = ("jinja", "fast")
+ARCHIVE_FORMATS = ("tar", "tgz", "zip")
@@ -0,0 +1,179 @@
+_ROUTE = (
+    "via `ip route list match 0 table all scope global | awk '{print $3}'` "
+    "dev `ip route list match 0 table all scope global | awk '{print $5}'`"
+)
+
+
+class _ServerFragments:
+    # everything of wg_client.conf.j2 that only depends on the server, with
+    # the client fields going in between
+    __slots__ = (
+        "header",
+        "android",
+        "mtu",
+        "bind",
+        "dns",
+        "udp2raw",
+        "peer",
+        "keepalive",
+        "allowed",
+    )
+
+    def __init__(self, server):
+        self.header = f"# - server : {server.name}\n# - client : "
+        self.android = None
+        self.udp2raw = None
+
+        if server.udp2raw:
+            self.android = (
+                f"\n# actual_endpoint {server.ip}\n# wgquick_path    ",
+                "\n# udp2raw_path    ",
+                f"\n# udp2raw_port    {server.udp2raw.port}\n"
+                f"# udp2raw_pass    {server.udp2raw.secret}\n",
+            )
+            self.udp2raw = (
+                f"\nPreUp = ip route add {server.ip} {_ROUTE}\n"
+                f"PreUp = udp2raw -c -l 127.0.0.1:50001 -r "
+                f"{server.endpoint_ip}:{server.udp2raw.port} -k "
+                f'"{server.udp2raw.secret}" -a >"',
+                f'" 2>&1 &\nPostDown = ip route del {server.ip} {_ROUTE}\n'
+                f"PostDown = pkill -15 udp2raw || true\n",
+            )
+
+        self.mtu = f"\nMTU = {server.mtu}\n"
+        self.bind = (
+            '\nPostUp = mkdir -p "/tmp/bind"\n'
+            f'PostUp = echo \'zone "." {{ type forward; forwarders '
+            f"{{ {server.internal_ip}; }}; }};' > '/tmp/bind/named.conf.local'\n"
+            "PostUp = rndc reload\n\n"
+            'PreDown = mkdir -p "/tmp/bind"\n'
+            'PreDown = echo \'zone "." { type hint; file "',
+            '"; };\' > "/tmp/bind/named.conf.local"\nPreDown = rndc reload\n',
+        )
+        self.dns = f"DNS = {server.internal_ip}\n"
+
+        if server.udp2raw:
+            endpoint = "127.0.0.1:50001"
+            keepalive = 120
+        else:
+            endpoint = f"{server.endpoint_ip}:{server.port}"
+            keepalive = 25
+
+        self.peer = (
+            f"\n[Peer]\nPublicKey = {server.pub}\nEndpoint = {endpoint}\n"
+            f"AllowedIPs = {server.default_allowed}"
+        )
+        self.keepalive = f"\nPersistentKeepalive = {keepalive}\n"
+
+        # id() of a client_extra_allowed list -> its string, clients without
+        # networks of their own all share the same list
+        self.allowed = {}
+
+
+class FastRenderer:
+    # wg_client.conf.j2 and wg_server.conf.j2 put together with plain string
+    # joins, byte for byte what jinja renders. the parts that only depend on
+    # the server are built once per server. anything else goes through jinja.
+    TEMPLATES = ("wg_server.conf.j2", "wg_client.conf.j2")
+
+    def __init__(self):
+        self.server = None
+        self.fragments = None
+
+    def _client(self, server, client):
+        if server is not self.server:
+            self.server = server
+            self.fragments = _ServerFragments(server)
+
+        fragments = self.fragments
+        parts = [
+            fragments.header,
+            client.name,
+            "\n# - private: ",
+            client.priv,
+            "\n# - public : ",
+            client.pub,
+            "\n",
+        ]
+
+        if client.android and server.udp2raw:
+            android = fragments.android
+            parts += (
+                android[0],
+                client.wgquick_path,
+                android[1],
+                client.udp2raw_path,
+                android[2],
+            )
+
+        parts += (
+            "\n[Interface]\nAddress = ",
+            client.address_str,
+            "\nPrivateKey = ",
+            client.priv,
+            fragments.mtu,
+        )
+
+        if client.bind:
+            parts += (fragments.bind[0], client.root_zone_file, fragments.bind[1])
+
+        if client.wg_handled_dns:
+            parts.append(fragments.dns)
+
+        if server.udp2raw and not client.android:
+            parts += (
+                fragments.udp2raw[0],
+                client.udp2raw_log_path,
+                fragments.udp2raw[1],
+            )
+
+        networks = id(client.client_extra_allowed)
+        allowed = fragments.allowed.get(networks)
+
+        if allowed is None:
+            allowed = fragments.allowed[networks] = client.client_extra_allowed_str
+
+        parts += (fragments.peer, allowed, fragments.keepalive)
+
+        return "".join(map(str, parts))
+
+    @staticmethod
+    def _server(server):
+        parts = [
+            f"# - server : {server.name}\n# - private: {server.priv}\n"
+            f"# - public : {server.pub}\n\n[Interface]\n"
+            f"PrivateKey = {server.priv}\nAddress = {server.address_str}\n"
+            f"ListenPort = {server.port}\nMTU = {server.mtu}\n"
+        ]
+
+        if server.udp2raw:
+            parts.append(
+                f"\nPreUp = udp2raw -s -l {server.endpoint_ip}:{server.udp2raw.port} "
+                f'-r 127.0.0.1:{server.port} -k "{server.udp2raw.secret}" '
+                "-a >/var/log/udp2raw.log 2>&1 &\n"
+                "PostDown = pkill -15 udp2raw || true\n"
+            )
+
+        # Address of every client, out of the strings allocation left behind
+        bits = server.net.max_prefixlen
+        addresses = [f"{ip}/{bits}" for ip in server.addresses.ip_strs]
+
+        if server.addresses6 is not None:
+            addresses = [
+                f"{address},{ip6}/128"
+                for address, ip6 in zip(addresses, server.addresses6.ip_strs)
+            ]
+
+        parts += (
+            f"\n# {client.name}\n[Peer]\nPublicKey = {client.pub}\n"
+            f"AllowedIPs = {address}{client.server_extra_allowed_str}\n"
+            for client, address in zip(server.clients, addresses)
+        )
+
+        return "".join(parts)
+
+    def render(self, template_name, server, client=None):
+        if template_name == "wg_client.conf.j2":
+            return self._client(server, client)
+
+        return self._server(server)
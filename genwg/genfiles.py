@@ -1,22 +1,192 @@
+import hashlib
+import json
+import logging
+import operator
 import os
 import shutil
 import time
 
-import jinja2
-import yaml
+from .fastrender import FastRenderer
+from .loader import dump
+from .log import Progress
+from .profiling import NULL_PROFILER
+from .render import get_digest, get_template
+from .writer import ArchiveWriter, ArtifactWriter, source_date_epoch, write_atomic
 
 
 class GenFiles:
-    _TEMPLATES_DIR = f"{os.path.dirname(os.path.realpath(__file__))}/templates"
-
-    def __init__(self, config, root_logger):
+    _MANIFEST = "genwg_dump/.genwg-manifest.json"
+    _LEASES = "genwg_dump/genwg-leases.yml"
+
+    # server and client attributes read by each template, an artifact is only
+    # re-rendered in incremental mode when one of these or the template changes
+    _SERVER_FIELDS = {
+        "wg_server.conf.j2": (
+            "name",
+            "priv",
+            "pub",
+            "ip",
+            "address_str",
+            "port",
+            "mtu",
+            "udp2raw.port",
+            "udp2raw.secret",
+        ),
+        "wg_client.conf.j2": (
+            "name",
+            "pub",
+            "ip",
+            "internal_ip",
+            "default_allowed",
+            "port",
+            "mtu",
+            "udp2raw.port",
+            "udp2raw.secret",
+        ),
+        "bind_a_zone.j2": ("name", "internal_ip", "internal_ip6", "named.hostname"),
+        "bind_ptr_zone.j2": (
+            "name",
+            "named.hostname",
+            "addresses.internal_ptr_zone",
+            "addresses.internal_ptr_label",
+            "addresses6.internal_ptr_zone",
+            "addresses6.internal_ptr_label",
+        ),
+        "bind.conf.j2": ("name", "ptr_origins", "named.conf_dir"),
+    }
+
+    _CLIENT_FIELDS = {
+        "wg_server.conf.j2": ("name", "pub", "address_str", "server_extra_allowed_str"),
+        "wg_client.conf.j2": (
+            "name",
+            "priv",
+            "pub",
+            "address_str",
+            "android",
+            "wgquick_path",
+            "udp2raw_path",
+            "udp2raw_log_path",
+            "bind",
+            "root_zone_file",
+            "wg_handled_dns",
+        ),
+        "bind_a_zone.j2": ("name", "ip", "ip6"),
+        "bind_ptr_zone.j2": ("name", "host_bit", "ip6"),
+    }
+
+    # (list, field rendered out of it) of client fields built from a network
+    # list most clients of a server share, hashed once per list instead of
+    # once per client
+    _SHARED_FIELDS = {
+        "wg_client.conf.j2": ("client_extra_allowed", "client_extra_allowed_str")
+    }
+
+    def __init__(
+        self,
+        config,
+        root_logger,
+        *,
+        incremental=False,
+        writers=4,
+        archive=None,
+        archive_format=None,
+        writer=None,
+        renderer="jinja",
+        profiler=NULL_PROFILER,
+    ):
         self.servers = config.servers
         self.logger = root_logger.getChild(self.__class__.__name__)
+        self.incremental = incremental
+        # stays on when -i falls back to regenerating everything, so that the
+        # next -i run has something to compare against
+        self.fingerprints = incremental
+        self.archive = archive
+        self.profiler = profiler
+        self.fast = FastRenderer() if renderer == "fast" else None
+
+        if writer is not None:
+            self.writer = writer
+        elif self.archive:
+            self.writer = ArchiveWriter(
+                archive, "genwg_dump", archive_format, profiler=profiler
+            )
+        else:
+            self.writer = ArtifactWriter(
+                "genwg_dump", workers=writers, profiler=profiler
+            )
+
+        self.old_manifest = {}
+        self.old_serials = {}
+        self.manifest = {}
+        self.serials = {}
+        self.serial_base = int(time.time())
+        self.dump_time = time.localtime(self.serial_base)
+        self.written = 0
+        self.unchanged = 0
+
+        # set by serve, servers unchanged since its last run and the manifest
+        # that run left. their fingerprints are taken from it as long as the
+        # manifest on disk still agrees.
+        self.kept_servers = set()
+        self.kept_manifest = {}
+
+        self._server_fingerprints = {}
+        self._shared_digests = {}
+
+        # zone serials and the yaml dump name of archives come from
+        # SOURCE_DATE_EPOCH too, so that the same input gives the same bytes
+        epoch = source_date_epoch() if self.archive else None
+
+        if epoch is not None:
+            self.serial_base = epoch
+            self.dump_time = time.gmtime(epoch)
+
+    def _load_manifest(self):
+        try:
+            with open(self._MANIFEST, "r", encoding="utf-8") as manifest_file:
+                manifest = json.load(manifest_file)
+        except (OSError, ValueError):
+            manifest = None
+
+        if not isinstance(manifest, dict) or not isinstance(
+            manifest.get("files"), dict
+        ):
+            if self.incremental:
+                self.logger.warning("no usable manifest, regenerating everything")
+                self.incremental = False
+
+            return
+
+        self.old_serials = manifest.get("serials", {})
+
+        if self.incremental:
+            self.old_manifest = manifest["files"]
+
+    def create_dirs(self):
+        if self.archive:
+            # archives have nothing to do with whatever genwg_dump is around,
+            # serials included
+            if self.incremental:
+                self.logger.warning("incremental mode does not apply to archives")
+                self.incremental = self.fingerprints = False
+
+            self.logger.info(
+                "writing a %s archive to %s",
+                self.writer.archive_format,
+                "stdout" if self.archive == "-" else self.archive,
+            )
+            return
+
+        # zone serials have to keep increasing across runs, so the previous
+        # ones are needed even when everything gets regenerated. falls back
+        # to a full regeneration when there is no usable manifest.
+        self._load_manifest()
 
-    def _create_dirs(self):
         self.logger.info("creating directories")
 
-        if os.path.exists("genwg_dump"):
+        if self.incremental:
+            self.logger.info("incremental mode, keeping genwg_dump")
+        elif os.path.exists("genwg_dump"):
             self.logger.warning("collision found, removing")
 
             try:
@@ -30,7 +200,7 @@ class GenFiles:
                 self.logger.exception("removing collision failed")
 
         try:
-            os.mkdir("genwg_dump")
+            os.makedirs("genwg_dump", exist_ok=True)
         except:
             self.logger.exception("failed creating the root directory")
 
@@ -40,74 +210,225 @@ class GenFiles:
         except:
             self.logger.exception("failed creating subdirectories")
 
-    def _template(self):
-        env = jinja2.Environment(
-            loader=jinja2.FileSystemLoader(self._TEMPLATES_DIR),
-            trim_blocks=True,
-            lstrip_blocks=True,
-        )
+    @staticmethod
+    def _field(obj, field):
+        for attr in field.split("."):
+            obj = getattr(obj, attr, None)
+
+        return obj
+
+    def _server_fingerprint(self, template_name, server):
+        # the template and the server fields, hashed once per server and
+        # copied for each of its artifacts
+        key = (template_name, server.name)
+        fingerprint = self._server_fingerprints.get(key)
+
+        if fingerprint is None:
+            fingerprint = hashlib.sha256(get_digest(template_name).encode())
+
+            fields = [
+                self._field(server, field)
+                for field in self._SERVER_FIELDS[template_name]
+            ]
+            fingerprint.update(repr(fields).encode("utf-8"))
+
+            self._server_fingerprints[key] = fingerprint
+
+        return fingerprint.copy()
+
+    def _shared_digest(self, peer, list_field, field):
+        # keyed by the id() of the list, which is kept alongside so that the
+        # id cannot get reused while this runs
+        networks = getattr(peer, list_field)
+        entry = self._shared_digests.get(id(networks))
+
+        if entry is None:
+            digest = hashlib.sha256(getattr(peer, field).encode("utf-8"))
+            entry = self._shared_digests[id(networks)] = (networks, digest.digest())
+
+        return entry[1]
+
+    def _fingerprint(self, template_name, server, client=None, zone=None):
+        fingerprint = self._server_fingerprint(template_name, server)
+
+        if client:
+            peers = [client]
+        elif zone:
+            fingerprint.update(zone.encode("utf-8"))
+            peers = server.ptr_zone_clients(zone)
+        else:
+            peers = server.clients
+
+        # hashed peer by peer, large servers never build one huge repr
+        client_fields = self._CLIENT_FIELDS.get(template_name)
+        shared_field = self._SHARED_FIELDS.get(template_name)
+
+        if client_fields:
+            get_fields = operator.attrgetter(*client_fields)
+
+            for peer in peers:
+                fingerprint.update(repr(get_fields(peer)).encode("utf-8"))
+
+                if shared_field:
+                    fingerprint.update(self._shared_digest(peer, *shared_field))
+
+        return fingerprint.hexdigest()
+
+    def _serial(self, path):
+        # SOA serials only ever go up, even across runs within the same second
+        return max(self.serial_base, self.old_serials.get(path, 0) + 1)
+
+    def _render(self, template_name, path, server, client=None, zone=None):
+        # only -i runs pay for fingerprints, the others record the path
+        # alone, for the next -i run to prune and regenerate
+        fingerprint = None
+
+        if server.name in self.kept_servers:
+            fingerprint = self.kept_manifest.get(path)
+
+        if self.fingerprints and (
+            fingerprint is None or self.old_manifest.get(path) != fingerprint
+        ):
+            fingerprint = self._fingerprint(template_name, server, client, zone)
+
+        self.manifest[path] = fingerprint
+
+        if (
+            fingerprint is not None
+            and self.old_manifest.get(path) == fingerprint
+            and os.path.isfile(f"./genwg_dump/{path}")
+        ):
+            if path in self.old_serials:
+                self.serials[path] = self.old_serials[path]
+
+            self.unchanged += 1
+            return
+
+        context = {"server": server}
+
+        if client:
+            context["client"] = client
+
+        if template_name in ("bind_a_zone.j2", "bind_ptr_zone.j2"):
+            context["zone"] = zone
+            context["serial"] = self.serials[path] = self._serial(path)
+
+        if self.fast and template_name in self.fast.TEMPLATES:
+            with self.profiler.phase("render"):
+                data = self.fast.render(template_name, server, client)
+        else:
+            # rendered lazily by whoever writes it out, zones with tens of
+            # thousands of records never sit in memory as a whole. when
+            # profiling it happens right here instead, to tell rendering and
+            # writing apart.
+            data = get_template(template_name).generate(**context)
+
+            if self.profiler.enabled:
+                with self.profiler.phase("render"):
+                    data = "".join(data)
+
+        self._write(path, data)
+        self.written += 1
+
+    def _write(self, path, data):
+        if self.profiler.enabled:
+            self.profiler.count("bytes", len(data.encode("utf-8")))
+
+        self.writer.write(path, data)
+
+    def template(self):
+        self.writer.start()
+
+        # per file lines only under -d, without even creating the records
+        peer_debug = self.logger.isEnabledFor(logging.DEBUG)
 
         for server in self.servers:
             self.logger.info("generating %s", server.name)
 
             # wireguard server peer configuration
-            template = env.get_template("wg_server.conf.j2")
-            result = template.render(server=server)
+            self._render("wg_server.conf.j2", f"server/{server.name}.conf", server)
 
-            with open(
-                f"./genwg_dump/server/{server.name}.conf", "w", encoding="utf-8"
-            ) as svfile:
-                svfile.write(result)
+            progress = Progress(
+                self.logger, f"{server.name} client configs", len(server.clients)
+            )
 
             for client in server.clients:
-                self.logger.info(" - client: %s", client.name)
+                if peer_debug:
+                    self.logger.debug(" - client: %s", client.name)
+
                 # wireguard client peer configuration
-                template = env.get_template("wg_client.conf.j2")
-                result = template.render(server=server, client=client)
+                self._render(
+                    "wg_client.conf.j2",
+                    f"client/{client.name}-{server.name}.conf",
+                    server,
+                    client,
+                )
+                progress.step()
 
-                with open(
-                    f"./genwg_dump/client/{client.name}-{server.name}.conf",
-                    "w",
-                    encoding="utf-8",
-                ) as clfile:
-                    clfile.write(result)
+            progress.done()
 
             if server.named:
                 # bind A zonefile
-                self.logger.info(" - bind: A records")
-                template = env.get_template("bind_a_zone.j2")
-                result = template.render(server=server)
-
-                with open(
-                    f"./genwg_dump/bind/zone/genwg/{server.name}", "w", encoding="utf-8"
-                ) as bindazonefile:
-                    bindazonefile.write(result)
-
-                # bind PTR zonefile
-                self.logger.info(" - bind: PTR records")
-                template = env.get_template("bind_ptr_zone.j2")
-                result = template.render(server=server)
-
-                with open(
-                    f"./genwg_dump/bind/zone/genwg/{server.ptr}",
-                    "w",
-                    encoding="utf-8",
-                ) as bindptrzonefile:
-                    bindptrzonefile.write(result)
+                self.logger.debug(" - bind: A records")
+                self._render("bind_a_zone.j2", f"bind/zone/genwg/{server.name}", server)
+
+                # bind PTR zonefiles, one per /24
+                self.logger.debug(" - bind: PTR records")
+                for zone in server.ptr_zones:
+                    self._render(
+                        "bind_ptr_zone.j2", f"bind/zone/genwg/{zone}", server, zone=zone
+                    )
 
                 # bind config
-                self.logger.info(" - bind: ISC configuration")
-                template = env.get_template("bind.conf.j2")
-                result = template.render(server=server)
-
-                with open(
-                    f"./genwg_dump/bind/{server.name}.conf",
-                    "w",
-                    encoding="utf-8",
-                ) as bindconfigfile:
-                    bindconfigfile.write(result)
-
-    def _dump_yaml(self):
+                self.logger.debug(" - bind: ISC configuration")
+                self._render("bind.conf.j2", f"bind/{server.name}.conf", server)
+
+    def _flush(self):
+        errors = self.writer.close()
+
+        if errors:
+            for path, exc in errors:
+                self.logger.warning("failed writing %s: %s", path, exc)
+
+            self.logger.error("%s of %s writes failed", len(errors), self.written)
+
+    def _prune(self):
+        removed = 0
+
+        # only outputs of peers that are gone from the configuration
+        for path in self.old_manifest:
+            if path in self.manifest:
+                continue
+
+            try:
+                os.remove(f"./genwg_dump/{path}")
+                removed += 1
+            except FileNotFoundError:
+                pass
+            except:
+                self.logger.exception("failed removing %s", path)
+
+        self.logger.info(
+            "%s written, %s unchanged, %s removed",
+            self.written,
+            self.unchanged,
+            removed,
+        )
+
+    def _save_manifest(self):
+        try:
+            write_atomic(
+                self._MANIFEST,
+                json.dumps(
+                    {"files": self.manifest, "serials": self.serials},
+                    indent=1,
+                    sort_keys=True,
+                ),
+            )
+        except:
+            self.logger.exception("failed saving the manifest")
+
+    def dump_yaml(self):
         self.logger.info("generating yaml dump")
 
         yaml_dict = {"servers": []}
@@ -119,22 +440,26 @@ class GenFiles:
                 "ip": str(server.ip),
                 "port": server.port,
                 "net": f"{server.net}/{server.pfx}",
-                "mtu": server.mtu,
             }
 
-            if server.extra_allowed:
-                client_extra_allowed_all = []
-                for client in server.clients:
-                    if client.extra_allowed:
-                        for network in client.extra_allowed:
-                            client_extra_allowed_all.append(network)
+            if server.net6 is not None:
+                sv_dict["net6"] = f"{server.net6}/{server.pfx6}"
 
-                for index, network in enumerate(server.extra_allowed):
-                    if network in client_extra_allowed_all:
-                        del server.extra_allowed[index]
+            sv_dict["mtu"] = server.mtu
 
-                if server.extra_allowed:
-                    sv_dict["extra_allowed"] = server.extra_allowed
+            # networks brought in by the clients go back to the clients
+            client_extra_allowed_all = set()
+            for client in server.clients:
+                client_extra_allowed_all.update(client.extra_allowed)
+
+            extra_allowed = [
+                str(network)
+                for network in server.extra_allowed
+                if network not in client_extra_allowed_all
+            ]
+
+            if extra_allowed:
+                sv_dict["extra_allowed"] = extra_allowed
 
             if server.named:
                 sv_dict["named"] = {
@@ -148,9 +473,9 @@ class GenFiles:
                     "port": server.udp2raw.port,
                 }
 
-            if server.extra_address_str:
-                sv_dict["extra_address"] = sv_dict["extra_address"] = [
-                    x for x in server.extra_address_str.split(",") if x
+            if server.extra_address:
+                sv_dict["extra_address"] = [
+                    str(address) for address in server.extra_address
                 ]
 
             sv_dict["clients"] = []
@@ -177,19 +502,78 @@ class GenFiles:
                         cl_dict["udp2raw_path"] = client.udp2raw_path
 
                 if client.extra_allowed:
-                    cl_dict["extra_allowed"] = client.extra_allowed
+                    cl_dict["extra_allowed"] = [
+                        str(network) for network in client.extra_allowed
+                    ]
 
                 sv_dict["clients"].append(cl_dict)
 
             yaml_dict["servers"].append(sv_dict)
 
-        yaml_str = yaml.dump(yaml_dict, indent=2, sort_keys=False)
-        yaml_filename = f"{time.strftime('%Y%m%d_%H%M%S')}-genwg.yml"
+        yaml_str = dump(yaml_dict)
+        yaml_filename = f"{time.strftime('%Y%m%d_%H%M%S', self.dump_time)}-genwg.yml"
+
+        # in the manifest, so that the next incremental run prunes this one
+        # instead of piling dumps up
+        self.manifest[yaml_filename] = None
+        self._write(yaml_filename, yaml_str)
+
+    def _dump_leases(self):
+        leases = {}
+
+        for server in self.servers:
+            server_leases = leases.setdefault(server.name, {})
+
+            for client in server.clients:
+                if client.ip6 is None:
+                    server_leases.setdefault(client.name, str(client.ip))
+                else:
+                    server_leases.setdefault(
+                        client.name, [str(client.ip), str(client.ip6)]
+                    )
+
+        leases_str = dump(leases)
+        self._write("genwg-leases.yml", leases_str)
+
+        # the next run allocates from genwg_dump, archives included, so they
+        # leave their leases there too
+        if self.archive:
+            try:
+                os.makedirs("genwg_dump", exist_ok=True)
+                write_atomic(self._LEASES, leases_str)
+            except OSError as exc:
+                self.logger.warning("failed saving %s: %s", self._LEASES, exc)
+
+    def render(self, dumps=False):
+        # every peer and zone file into the writer, leaving genwg_dump alone.
+        # the yaml and lease dumps only with dumps.
+        self.template()
+
+        if dumps:
+            self.dump_yaml()
+            self._dump_leases()
+
+        self._flush()
+
+    def run(self, render=True):
+        steps = []
+
+        # sharded runs render in the worker processes
+        if render:
+            steps += [("create_dirs", self.create_dirs), ("template", self.template)]
+
+        steps += [
+            ("dump_yaml", self.dump_yaml),
+            ("dump_leases", self._dump_leases),
+            ("flush", self._flush),
+        ]
+
+        if not self.archive:
+            steps += [("prune", self._prune), ("save_manifest", self._save_manifest)]
 
-        with open(f"./genwg_dump/{yaml_filename}", "w", encoding="utf-8") as yaml_file:
-            yaml_file.write(yaml_str)
+        for name, step in steps:
+            with self.profiler.phase(name):
+                step()
 
-    def run(self):
-        self._create_dirs()
-        self._template()
-        self._dump_yaml()
+        self.profiler.count("files_written", self.written)
+        self.profiler.count("files_unchanged", self.unchanged)
@@ -0,0 +1,274 @@
+import base64
+import binascii
+import concurrent.futures
+import functools
+
+from .constants import POOLS
+
+# curve25519 field prime and the (A - 2) / 4 ladder constant, rfc 7748
+_P = 2**255 - 19
+_A24 = 121665
+_BASE_U = 9
+
+# 2 * d of the birationally equivalent edwards curve and its base point, the
+# one that maps to u = 9
+_D2 = -121665 * pow(121666, _P - 2, _P) * 2 % _P
+_BASE_X = 15112221349535400772501151409588531511454012693041857206046113283949847762202
+_BASE_Y = 46316835694926478169428394003475163141307993866256225615783033603165251855960
+
+# a table entry of _base_table(), and the one of the point at infinity
+_FIELD = (1 << 256) - 1
+_IDENTITY = 1 | 1 << 256
+
+
+class WGKeyError(Exception):
+    pass
+
+
+def _clamp(key):
+    key = bytearray(key)
+    key[0] &= 248
+    key[31] &= 127
+    key[31] |= 64
+
+    return bytes(key)
+
+
+def _x25519(scalar, u):
+    # montgomery ladder as laid out in rfc 7748, section 5. the swaps are
+    # arithmetic rather than branches on the bits of the key.
+    k = int.from_bytes(_clamp(scalar), "little")
+
+    x_1 = u
+    x_2, z_2 = 1, 0
+    x_3, z_3 = u, 1
+    swap = 0
+
+    for t in range(254, -1, -1):
+        k_t = (k >> t) & 1
+        swap ^= k_t
+
+        dummy = swap * (x_2 - x_3)
+        x_2 -= dummy
+        x_3 += dummy
+        dummy = swap * (z_2 - z_3)
+        z_2 -= dummy
+        z_3 += dummy
+
+        swap = k_t
+
+        a = x_2 + z_2
+        aa = a * a % _P
+        b = x_2 - z_2
+        bb = b * b % _P
+        e = aa - bb
+        c = x_3 + z_3
+        d = x_3 - z_3
+        da = d * a % _P
+        cb = c * b % _P
+
+        x_3 = (da + cb) ** 2 % _P
+        z_3 = x_1 * (da - cb) ** 2 % _P
+        x_2 = aa * bb % _P
+        z_2 = e * (aa + _A24 * e) % _P
+
+    x_2 -= swap * (x_2 - x_3)
+    z_2 -= swap * (z_2 - z_3)
+
+    return (x_2 * pow(z_2, _P - 2, _P) % _P).to_bytes(32, "little")
+
+
+def _edwards_add(p_1, p_2):
+    # extended coordinates, add-2008-hwcd-3
+    x_1, y_1, z_1, t_1 = p_1
+    x_2, y_2, z_2, t_2 = p_2
+
+    a = (y_1 - x_1) * (y_2 - x_2) % _P
+    b = (y_1 + x_1) * (y_2 + x_2) % _P
+    c = t_1 * _D2 * t_2 % _P
+    d = z_1 * 2 * z_2 % _P
+    e, f, g, h = b - a, d - c, d + c, b + a
+
+    return e * f % _P, g * h % _P, f * g % _P, e * h % _P
+
+
+@functools.cache
+def _base_table():
+    # 1 to 8 times 16^i times the base point for i up to 64, as affine
+    # (y - x, y + x, 2dxy) packed into a single int of 256 bit fields. built
+    # once per process, a few ms.
+    points = []
+    base = (_BASE_X, _BASE_Y, 1, _BASE_X * _BASE_Y % _P)
+
+    for _ in range(65):
+        point = base
+        for _ in range(8):
+            points.append(point)
+            point = _edwards_add(point, base)
+
+        base = _edwards_add(points[-1], points[-1])
+
+    # a single inversion for all of them
+    prefix = []
+    acc = 1
+    for point in points:
+        prefix.append(acc)
+        acc = acc * point[2] % _P
+
+    inv = pow(acc, _P - 2, _P)
+    table = [None] * len(points)
+
+    for i in range(len(points) - 1, -1, -1):
+        x, y, z, _ = points[i]
+        z_inv = inv * prefix[i] % _P
+        inv = inv * z % _P
+        x = x * z_inv % _P
+        y = y * z_inv % _P
+        table[i] = (y - x) % _P | (y + x) % _P << 256 | x * y * _D2 % _P << 512
+
+    return [table[i : i + 8] for i in range(0, len(table), 8)]
+
+
+def _x25519_base(scalar):
+    # _x25519(scalar, _BASE_U), out of a precomputed table on the edwards
+    # curve in 4 bit signed windows, which takes a third of the time of the
+    # ladder. every table entry of a window is read and the negation is
+    # arithmetic, so nothing branches on or gets indexed by the key.
+    k = int.from_bytes(_clamp(scalar), "little")
+
+    x, y, z, t = 0, 1, 1, 0
+    carry = 0
+
+    for i, row in enumerate(_base_table()):
+        digit = ((k >> (4 * i)) & 15) + carry
+        carry = (digit + 8) >> 4
+        digit -= carry << 4
+
+        # -8 <= digit < 8, split into its sign and its absolute value
+        neg = (digit >> 8) & 1
+        digit = (digit ^ -neg) + neg
+
+        # the point at infinity when digit is 0
+        entry = _IDENTITY
+        for j, packed in enumerate(row, 1):
+            entry += (1 - (((digit ^ j) + 255) >> 8)) * (packed - _IDENTITY)
+
+        y_minus_x = entry & _FIELD
+        y_plus_x = (entry >> 256) & _FIELD
+        t_2d = entry >> 512
+
+        dummy = neg * (y_plus_x - y_minus_x)
+        y_minus_x += dummy
+        y_plus_x -= dummy
+        t_2d -= 2 * neg * t_2d
+
+        a = (y - x) * y_minus_x % _P
+        b = (y + x) * y_plus_x % _P
+        c = t * t_2d % _P
+        d = 2 * z
+        e, f, g, h = b - a, d - c, d + c, b + a
+        x, y, z, t = e * f % _P, g * h % _P, f * g % _P, e * h % _P
+
+    # back to montgomery, u = (1 + y) / (1 - y)
+    return ((z + y) * pow(z - y, _P - 2, _P) % _P).to_bytes(32, "little")
+
+
+def _decode_key(key):
+    # wg only accepts the exact 44 char padded base64 form of a 32 byte key
+    if not isinstance(key, str) or len(key) != 44 or key[-1] != "=":
+        raise WGKeyError("Key is not the correct length or format")
+
+    try:
+        raw = base64.b64decode(key, validate=True)
+    except binascii.Error as exc:
+        raise WGKeyError("Key is not the correct length or format") from exc
+
+    # 44 chars ending in "==" only carry 31 bytes
+    if len(raw) != 32:
+        raise WGKeyError("Key is not the correct length or format")
+
+    return raw
+
+
+def _encode_key(raw):
+    return base64.b64encode(raw).decode("ascii")
+
+
+class X25519Backend:
+    name = "x25519"
+
+    def genkey(self):
+        import secrets
+
+        return _encode_key(_clamp(secrets.token_bytes(32)))
+
+    def pubkey(self, priv_key):
+        return _encode_key(_x25519_base(_decode_key(priv_key)))
+
+
+class WGBackend:
+    name = "wg"
+
+    def __init__(self, wg_bin="wg"):
+        self.wg_bin = wg_bin
+
+    def _run(self, args, stdin=None):
+        import subprocess
+
+        try:
+            proc = subprocess.run(
+                [self.wg_bin, *args], input=stdin, check=True, capture_output=True
+            )
+        except subprocess.CalledProcessError as exc:
+            raise WGKeyError(exc.stderr.decode("utf-8").rstrip("\n")) from exc
+        except OSError as exc:
+            raise WGKeyError(f"failed executing {self.wg_bin}: {exc}") from exc
+
+        return proc.stdout.decode("utf-8").rstrip("\n")
+
+    def genkey(self):
+        return self._run(["genkey"])
+
+    def pubkey(self, priv_key):
+        return self._run(["pubkey"], stdin=f"{priv_key}\n".encode("utf-8"))
+
+
+BACKENDS = {
+    X25519Backend.name: X25519Backend,
+    WGBackend.name: WGBackend,
+}
+
+
+def get_backend(name, wg_bin="wg"):
+    if name == WGBackend.name:
+        return WGBackend(wg_bin)
+
+    try:
+        return BACKENDS[name]()
+    except KeyError as exc:
+        raise WGKeyError(f"unknown key backend: {name}") from exc
+
+
+def _derive(backend, priv_key):
+    if priv_key is None:
+        priv_key = backend.genkey()
+
+    return priv_key, backend.pubkey(priv_key)
+
+
+def derive_keys(backend, priv_keys, jobs=1, pool="process"):
+    # priv_keys is a list of private keys, None for the ones that need to be
+    # generated. returns [(priv, pub), ...] in the same order as priv_keys.
+    derive = functools.partial(_derive, backend)
+
+    if jobs <= 1 or len(priv_keys) <= 1:
+        return [derive(priv_key) for priv_key in priv_keys]
+
+    # hand the work out in batches so that process pools do not pay an ipc
+    # round trip per key
+    chunksize = max(1, len(priv_keys) // (jobs * 4))
+
+    executor_class = getattr(concurrent.futures, POOLS[pool])
+
+    with executor_class(max_workers=jobs) as executor:
+        return list(executor.map(derive, priv_keys, chunksize=chunksize))
@@ -0,0 +1,168 @@
+import yaml
+
+# libyaml backed loader and dumper when pyyaml was built against it
+SafeLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+SafeDumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+
+
+class _Composer:
+    # builds nodes straight from the event stream. the pure python loader has
+    # compose_node(), the libyaml one does not, so this works for both.
+    def __init__(self, loader):
+        self.loader = loader
+        self.anchors = {}
+
+    def expect(self, event_type):
+        if not self.loader.check_event(event_type):
+            event = self.loader.peek_event()
+            raise yaml.YAMLError(
+                f"expected {event_type.__name__}, got {type(event).__name__}"
+                f"{event.start_mark}"
+            )
+
+        return self.loader.get_event()
+
+    def compose(self):
+        event = self.loader.get_event()
+
+        if isinstance(event, yaml.AliasEvent):
+            try:
+                return self.anchors[event.anchor]
+            except KeyError as exc:
+                raise yaml.YAMLError(
+                    f"found undefined alias {event.anchor}{event.start_mark}"
+                ) from exc
+
+        if isinstance(event, yaml.ScalarEvent):
+            tag = event.tag
+            if tag is None or tag == "!":
+                tag = self.loader.resolve(yaml.ScalarNode, event.value, event.implicit)
+
+            node = yaml.ScalarNode(
+                tag, event.value, event.start_mark, event.end_mark, event.style
+            )
+
+            if event.anchor is not None:
+                self.anchors[event.anchor] = node
+        elif isinstance(event, yaml.SequenceStartEvent):
+            tag = event.tag
+            if tag is None or tag == "!":
+                tag = self.loader.resolve(yaml.SequenceNode, None, event.implicit)
+
+            node = yaml.SequenceNode(
+                tag, [], event.start_mark, None, flow_style=event.flow_style
+            )
+
+            if event.anchor is not None:
+                self.anchors[event.anchor] = node
+
+            while not self.loader.check_event(yaml.SequenceEndEvent):
+                node.value.append(self.compose())
+
+            node.end_mark = self.loader.get_event().end_mark
+        elif isinstance(event, yaml.MappingStartEvent):
+            tag = event.tag
+            if tag is None or tag == "!":
+                tag = self.loader.resolve(yaml.MappingNode, None, event.implicit)
+
+            node = yaml.MappingNode(
+                tag, [], event.start_mark, None, flow_style=event.flow_style
+            )
+
+            if event.anchor is not None:
+                self.anchors[event.anchor] = node
+
+            while not self.loader.check_event(yaml.MappingEndEvent):
+                node.value.append((self.compose(), self.compose()))
+
+            node.end_mark = self.loader.get_event().end_mark
+        else:
+            raise yaml.YAMLError(f"unexpected {type(event).__name__}{event.start_mark}")
+
+        return node
+
+
+def load(stream):
+    return yaml.load(stream, Loader=SafeLoader)
+
+
+def compose(stream):
+    return yaml.compose(stream, Loader=SafeLoader)
+
+
+def construct(node):
+    loader = SafeLoader("")
+
+    try:
+        return loader.construct_document(node)
+    finally:
+        loader.dispose()
+
+
+def represent(data):
+    # yaml nodes of data that never was a document, e.g. a dict handed to the
+    # library api. there is nothing to point at, so they carry no marks.
+    dumper = SafeDumper(None, sort_keys=False)
+
+    try:
+        return dumper.represent_data(data)
+    finally:
+        dumper.dispose()
+
+
+def dump(data):
+    return yaml.dump(data, Dumper=SafeDumper, indent=2, sort_keys=False)
+
+
+def _iter_sequence_nodes(loader, key):
+    # yields the nodes of the top level `key` sequence one at a time, the
+    # rest of the document is parsed and thrown away as it goes
+    composer = _Composer(loader)
+
+    composer.expect(yaml.StreamStartEvent)
+    composer.expect(yaml.DocumentStartEvent)
+    composer.expect(yaml.MappingStartEvent)
+
+    found = False
+    while not loader.check_event(yaml.MappingEndEvent):
+        key_node = composer.compose()
+
+        if not isinstance(key_node, yaml.ScalarNode) or key_node.value != key:
+            composer.compose()
+            continue
+
+        found = True
+
+        # blank or not a list, nothing to hand out
+        if not loader.check_event(yaml.SequenceStartEvent):
+            composer.compose()
+            continue
+
+        composer.expect(yaml.SequenceStartEvent)
+
+        while not loader.check_event(yaml.SequenceEndEvent):
+            yield composer.compose()
+
+        loader.get_event()
+
+    if not found:
+        raise KeyError(key)
+
+
+def iter_nodes(stream, key):
+    loader = SafeLoader(stream)
+
+    try:
+        yield from _iter_sequence_nodes(loader, key)
+    finally:
+        loader.dispose()
+
+
+def iter_sequence(stream, key):
+    loader = SafeLoader(stream)
+
+    try:
+        for node in _iter_sequence_nodes(loader, key):
+            yield loader.construct_document(node)
+    finally:
+        loader.dispose()
@@ -1,5 +1,7 @@
 import logging
 import sys
+import threading
+import time
 
 
 class ANSIColors:
@@ -32,10 +34,43 @@ c = ANSIColors()
 
 class ShutdownHandler(logging.StreamHandler):
     def emit(self, record):
-        if record.levelno >= logging.ERROR:
+        # deferred errors are collected and followed by one that is not
+        if record.levelno >= logging.ERROR and not getattr(record, "deferred", False):
             sys.exit(1)
 
 
+class GenWGError(Exception):
+    def __init__(self, message, errors=()):
+        super().__init__(message)
+        self.errors = list(errors)  # deferred errors that led up to it
+
+
+class RaiseHandler(logging.Handler):
+    # ShutdownHandler for library use: the first error that is not deferred
+    # raises GenWGError in the thread that logged it instead of exiting, with
+    # the deferred ones logged by that thread before it
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self.local = threading.local()
+
+    def reset(self):
+        self.local.errors = []
+
+    def emit(self, record):
+        errors = getattr(self.local, "errors", None)
+
+        if errors is None:
+            errors = self.local.errors = []
+
+        if getattr(record, "deferred", False):
+            errors.append(record.getMessage())
+            return
+
+        self.local.errors = []
+
+        raise GenWGError(record.getMessage(), errors)
+
+
 class GenWGFormatter(logging.Formatter):
     _FMT_DATE = "%H:%M:%S"
     _FMT_BEGIN = f"{c.BBLK}["
@@ -50,18 +85,76 @@ class GenWGFormatter(logging.Formatter):
         logging.CRITICAL: c.LRED,
     }
 
-    def format(self, record):
-        finfmt = f"{self._FMT_BEGIN}{self._FORMATS.get(record.levelno)}"
+    def __init__(self):
+        super().__init__()
+
+        # one formatter per level, built once
+        self._formatters = {levelno: self._build(levelno) for levelno in self._FORMATS}
+
+    def _build(self, levelno):
+        finfmt = f"{self._FMT_BEGIN}{self._FORMATS.get(levelno)}"
         finfmt += f"%(levelname)-.1s{self._FMT_END} %(message)s"
 
-        return logging.Formatter(
-            fmt=finfmt, datefmt=self._FMT_DATE, validate=True
-        ).format(record)
+        return logging.Formatter(fmt=finfmt, datefmt=self._FMT_DATE, validate=True)
+
+    def format(self, record):
+        formatter = self._formatters.get(record.levelno)
+
+        if formatter is None:
+            formatter = self._formatters[record.levelno] = self._build(record.levelno)
+
+        return formatter.format(record)
+
+
+class Progress:
+    # counts and rates for loops over peers: at most one line per interval
+    # while it runs and a summary once it is done. per peer lines are left
+    # to debug.
+    def __init__(self, logger, what, total, interval=1.0):
+        self.logger = logger
+        self.what = what
+        self.total = total
+        self.interval = interval
 
+        self.enabled = logger.isEnabledFor(logging.INFO)
+        self.count = 0
+        self.start = self.last = time.monotonic()
 
-def set_root_logger(debug=False):
+    def step(self):
+        self.count += 1
+
+        # the clock is only looked at every 256 peers
+        if not self.enabled or self.count & 255:
+            return
+
+        now = time.monotonic()
+        if now - self.last >= self.interval:
+            self.last = now
+            self.logger.info("%s: %s/%s", self.what, self.count, self.total)
+
+    def done(self):
+        if not self.enabled:
+            return
+
+        elapsed = time.monotonic() - self.start
+        self.logger.info(
+            "%s: %s in %.2fs, %.0f/s",
+            self.what,
+            self.count,
+            elapsed,
+            self.count / elapsed if elapsed else 0,
+        )
+
+
+def set_root_logger(debug=False, quiet=False):
     logger = logging.getLogger()
-    logger.setLevel(logging.DEBUG if debug else logging.INFO)
+
+    if debug:
+        logger.setLevel(logging.DEBUG)
+    elif quiet:
+        logger.setLevel(logging.WARNING)
+    else:
+        logger.setLevel(logging.INFO)
 
     formatter = GenWGFormatter()
     handler = logging.StreamHandler()
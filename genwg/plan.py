@@ -0,0 +1,108 @@
+import os
+import re
+import sys
+
+from .genfiles import GenFiles
+from .writer import MemoryWriter
+
+
+class Plan:
+    # left out of the comparison, they change on every run
+    _IGNORED = (".genwg-manifest.json", "genwg-leases.yml")
+
+    # so are zone serials
+    _SERIAL_REGEX = re.compile(r"^(@ IN SOA \S+ \S+ \( )\d+", re.MULTILINE)
+
+    def __init__(
+        self, config, parent_logger, target, *, baseline=None, renderer="jinja"
+    ):
+        self.config = config
+        self.logger = parent_logger.getChild(self.__class__.__name__)
+        self.target = target
+        self.baseline = baseline  # ConfigYAML of a previous yaml dump
+        self.renderer = renderer
+
+        self.added = []
+        self.changed = []
+        self.removed = []
+
+    def _render(self, config):
+        writer = MemoryWriter()
+        GenFiles(config, self.logger, writer=writer, renderer=self.renderer).render()
+
+        return writer.files
+
+    def _read_tree(self):
+        files = {}
+
+        for dirpath, _, filenames in os.walk(self.target):
+            for filename in filenames:
+                path = os.path.relpath(os.path.join(dirpath, filename), self.target)
+
+                if os.sep != "/":
+                    path = path.replace(os.sep, "/")
+
+                if "/" not in path and (
+                    filename in self._IGNORED or filename.endswith("-genwg.yml")
+                ):
+                    continue
+
+                try:
+                    with open(
+                        os.path.join(dirpath, filename), "r", encoding="utf-8"
+                    ) as tree_file:
+                        files[path] = tree_file.read()
+                except (OSError, UnicodeDecodeError):
+                    self.logger.exception("failed reading %s", path)
+
+        return files
+
+    def _normalize(self, path, data):
+        if path.startswith("bind/zone/"):
+            return self._SERIAL_REGEX.sub(r"\g<1>0", data)
+
+        return data
+
+    def _compare(self, old, new):
+        for path in sorted(new.keys() | old.keys()):
+            if path not in old:
+                self.added.append(path)
+            elif path not in new:
+                self.removed.append(path)
+            elif self._normalize(path, old[path]) != self._normalize(path, new[path]):
+                self.changed.append(path)
+
+    def run(self):
+        if self.baseline is not None:
+            self.logger.info("rendering %s", self.target)
+            old = self._render(self.baseline)
+        elif os.path.isdir(self.target):
+            self.logger.info("reading %s", self.target)
+            old = self._read_tree()
+        else:
+            self.logger.error("%s is neither a directory nor a yaml dump", self.target)
+            return False
+
+        self.logger.info("rendering %s", self.config.config_file)
+        new = self._render(self.config)
+
+        self._compare(old, new)
+
+        for mark, paths in (
+            ("+", self.added),
+            ("~", self.changed),
+            ("-", self.removed),
+        ):
+            for path in paths:
+                print(f"{mark} {path}")
+
+        self.logger.info(
+            "%s added, %s changed, %s removed",
+            len(self.added),
+            len(self.changed),
+            len(self.removed),
+        )
+
+        sys.stdout.flush()
+
+        return bool(self.added or self.changed or self.removed)
@@ -0,0 +1,116 @@
+import contextlib
+import json
+import sys
+import threading
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def _peak_rss(who):
+    if resource is None:
+        return None
+
+    # kilobytes on linux, bytes on macos
+    peak = resource.getrusage(who).ru_maxrss
+
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class Profiler:
+    # wall and cpu time per phase plus a few counters. cpu time is that of
+    # the thread running the phase, phases run by several threads at once,
+    # like writes, add up.
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+
+        self.phases = {}  # name -> [wall, cpu, calls]
+        self.counts = {}
+        self.lock = threading.Lock()
+
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+
+    @contextlib.contextmanager
+    def _phase(self, name):
+        wall = time.perf_counter()
+        cpu = time.thread_time()
+
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wall
+            cpu = time.thread_time() - cpu
+
+            with self.lock:
+                phase = self.phases.setdefault(name, [0.0, 0.0, 0])
+                phase[0] += wall
+                phase[1] += cpu
+                phase[2] += 1
+
+    def phase(self, name):
+        if not self.enabled:
+            return contextlib.nullcontext()
+
+        return self._phase(name)
+
+    def count(self, name, value=1):
+        if not self.enabled:
+            return
+
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + value
+
+    def merge(self, phases, counts):
+        # phases and counts of another process, e.g. a shard worker
+        if not self.enabled:
+            return
+
+        with self.lock:
+            for name, (wall, cpu, calls) in phases.items():
+                phase = self.phases.setdefault(name, [0.0, 0.0, 0])
+                phase[0] += wall
+                phase[1] += cpu
+                phase[2] += calls
+
+            for name, value in counts.items():
+                self.counts[name] = self.counts.get(name, 0) + value
+
+    def report(self):
+        children = None
+        if resource is not None:
+            usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+            children = usage.ru_utime + usage.ru_stime
+
+        return {
+            "wall_seconds": time.perf_counter() - self.wall,
+            "cpu_seconds": time.process_time() - self.cpu,
+            "children_cpu_seconds": children,
+            "peak_rss_bytes": _peak_rss(resource.RUSAGE_SELF) if resource else None,
+            "children_peak_rss_bytes": (
+                _peak_rss(resource.RUSAGE_CHILDREN) if resource else None
+            ),
+            "phases": {
+                name: {"wall_seconds": wall, "cpu_seconds": cpu, "calls": calls}
+                for name, (wall, cpu, calls) in self.phases.items()
+            },
+            "counts": dict(sorted(self.counts.items())),
+        }
+
+    def save(self, path, **extra):
+        report = {**extra, **self.report()}
+        data = json.dumps(report, indent=1)
+
+        if path == "-":
+            sys.stdout.write(data + "\n")
+            sys.stdout.flush()
+        else:
+            with open(path, "w", encoding="utf-8") as profile_file:
+                profile_file.write(data + "\n")
+
+
+# stands in when nothing is being profiled
+NULL_PROFILER = Profiler(enabled=False)
@@ -0,0 +1,76 @@
+import functools
+import hashlib
+import os
+
+from .cache import cache_dir
+
+TEMPLATES_DIR = f"{os.path.dirname(os.path.realpath(__file__))}/templates"
+TEMPLATES = (
+    "wg_server.conf.j2",
+    "wg_client.conf.j2",
+    "bind_a_zone.j2",
+    "bind_ptr_zone.j2",
+    "bind.conf.j2",
+)
+
+# compiled templates and their source digests, shared by everything rendering
+# in this process
+_TEMPLATES = {}
+_DIGESTS = {}
+
+# only the cli keeps compiled templates on disk, the library api never touches
+# the filesystem
+_SETTINGS = {"bytecode_cache": False}
+
+
+def _bytecode_cache():
+    import jinja2
+
+    path = os.path.join(cache_dir(), "jinja")
+
+    try:
+        os.makedirs(path, mode=0o700, exist_ok=True)
+    except OSError:
+        return None
+
+    return jinja2.FileSystemBytecodeCache(path)
+
+
+def enable_bytecode_cache():
+    # has to happen before the first template gets compiled
+    _SETTINGS["bytecode_cache"] = True
+
+
+@functools.cache
+def get_env(bytecode_cache=False):
+    # jinja is only imported once something gets rendered
+    import jinja2
+
+    # templates ship with the package, no point in stat()'ing them on every
+    # lookup
+    return jinja2.Environment(
+        loader=jinja2.FileSystemLoader(TEMPLATES_DIR),
+        trim_blocks=True,
+        lstrip_blocks=True,
+        auto_reload=False,
+        bytecode_cache=_bytecode_cache() if bytecode_cache else None,
+    )
+
+
+def get_template(name):
+    try:
+        return _TEMPLATES[name]
+    except KeyError:
+        env = get_env(_SETTINGS["bytecode_cache"])
+        template = _TEMPLATES[name] = env.get_template(name)
+        return template
+
+
+def get_digest(name):
+    try:
+        return _DIGESTS[name]
+    except KeyError:
+        with open(f"{TEMPLATES_DIR}/{name}", "rb") as template_file:
+            digest = _DIGESTS[name] = hashlib.sha256(template_file.read()).hexdigest()
+
+        return digest
@@ -0,0 +1,176 @@
+import collections
+import json
+import signal
+import statistics
+import time
+
+from .genfiles import GenFiles
+from .watch import get_watcher
+from .writer import write_atomic
+
+
+class Serve:
+    # latencies kept around for the percentiles
+    _WINDOW = 1000
+
+    def __init__(
+        self,
+        config_file,
+        parent_logger,
+        new_config,
+        *,
+        writers=4,
+        metrics_file=None,
+        interval=1.0,
+        renderer="jinja",
+    ):
+        self.config_file = config_file
+        self.logger = parent_logger.getChild(self.__class__.__name__)
+        self.new_config = new_config
+        self.writers = writers
+        self.metrics_file = metrics_file
+        self.interval = interval
+        self.renderer = renderer
+
+        # the model of the last good reload, server name -> (yaml, Server),
+        # and the manifest it left behind
+        self.resident = {}
+        self.manifest = {}
+
+        self.reloads = 0
+        self.failures = 0
+        self.latencies = collections.deque(maxlen=self._WINDOW)
+        self.last = None
+
+    def _parse(self):
+        # the whole file still gets loaded and validated, checks span servers.
+        # only servers whose yaml differs from the resident one get parsed and
+        # their keys derived, the others are reused as they are.
+        config = self.new_config(self.config_file)
+        config.run(parse=False)
+
+        servers_yaml = config.yaml_parsed["servers"]
+        changed = [
+            server_yaml
+            for server_yaml in servers_yaml
+            if self.resident.get(server_yaml["name"], (None,))[0] != server_yaml
+        ]
+
+        config.yaml_parsed = {"servers": changed}
+        config.parse_yaml()
+        config.derive_keys()
+
+        parsed = {server.name: server for server in config.servers}
+        resident = {}
+
+        for server_yaml in servers_yaml:
+            name = server_yaml["name"]
+            server = parsed.get(name) or self.resident[name][1]
+            resident[name] = (server_yaml, server)
+
+        # back in the order of the file, for the yaml and lease dumps
+        config.servers[:] = [server for _, server in resident.values()]
+        config.count_peers()
+
+        self.logger.info("%s of %s servers changed", len(changed), len(servers_yaml))
+
+        return config, resident, set(resident) - set(parsed)
+
+    def _reload(self):
+        # the parsed model, the compiled templates and the key cache stay
+        # resident, so only what changed gets parsed, fingerprinted and written
+        start = time.perf_counter()
+
+        try:
+            config, resident, kept = self._parse()
+            parsed = time.perf_counter()
+
+            genfiles = GenFiles(
+                config,
+                self.logger,
+                incremental=True,
+                writers=self.writers,
+                renderer=self.renderer,
+            )
+            genfiles.kept_servers = kept
+            genfiles.kept_manifest = self.manifest
+
+            # a reload failing halfway would otherwise leave its writer
+            # threads around for as long as serve runs
+            try:
+                genfiles.run()
+            finally:
+                genfiles.writer.close()
+        except SystemExit:
+            # errors are fatal everywhere else, a bad edit should not be
+            self.failures += 1
+            self.logger.warning("reload failed, keeping the previous output")
+            return
+        except Exception:
+            self.failures += 1
+            self.logger.warning("reload failed", exc_info=True)
+            return
+
+        end = time.perf_counter()
+
+        self.resident = resident
+        self.manifest = genfiles.manifest
+
+        self.reloads += 1
+        self.latencies.append(end - start)
+        self.last = {
+            "seconds": end - start,
+            "parse_seconds": parsed - start,
+            "generate_seconds": end - parsed,
+        }
+
+        self.logger.info(
+            "reloaded in %.3fs, parse %.3fs, generate %.3fs",
+            self.last["seconds"],
+            self.last["parse_seconds"],
+            self.last["generate_seconds"],
+        )
+
+    def _save_metrics(self):
+        if not self.metrics_file:
+            return
+
+        metrics = {"reloads": self.reloads, "failures": self.failures}
+
+        if self.latencies:
+            latencies = sorted(self.latencies)
+
+            metrics["last"] = self.last
+            metrics["seconds"] = {
+                "min": latencies[0],
+                "max": latencies[-1],
+                "mean": statistics.fmean(latencies),
+                "p50": latencies[len(latencies) // 2],
+                "p95": latencies[min(len(latencies) * 95 // 100, len(latencies) - 1)],
+            }
+
+        try:
+            write_atomic(self.metrics_file, json.dumps(metrics, indent=1))
+        except OSError as exc:
+            self.logger.warning("failed saving metrics: %s", exc)
+
+    def run(self):
+        # a plain KeyboardInterrupt on SIGTERM too, so both stop the loop
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+
+        watcher = get_watcher(self.config_file, self.interval)
+        self.logger.info(
+            "watching %s with %s", self.config_file, watcher.__class__.__name__
+        )
+
+        try:
+            while True:
+                self._reload()
+                self._save_metrics()
+
+                watcher.wait()
+                self.logger.info("%s changed", self.config_file)
+        except KeyboardInterrupt:
+            self.logger.info("stopping")
+        finally:
+            watcher.close()
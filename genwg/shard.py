@@ -0,0 +1,312 @@
+import contextlib
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+from .cache import PubKeyCache
+from .config import ConfigYAML
+from .genfiles import GenFiles
+from .log import ShutdownHandler
+from .profiling import NULL_PROFILER, Profiler
+
+
+class _Recorder(logging.Handler):
+    def __init__(self, records):
+        super().__init__()
+        self.records = records
+
+    def emit(self, record):
+        # formatted right away, the arguments and the traceback might not
+        # survive the trip back to the parent
+        record.msg = record.getMessage()
+        record.args = None
+
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+
+        self.records.append(record)
+
+
+@contextlib.contextmanager
+def _recording(records):
+    # records end up in the list instead of on the terminal, errors still
+    # stop everything right where they happen
+    root = logging.getLogger()
+    handlers = root.handlers
+    root.handlers = [_Recorder(records), ShutdownHandler()]
+
+    try:
+        yield
+    finally:
+        root.handlers = handlers
+
+
+def _replay(records):
+    for record in records:
+        logging.getLogger(record.name).handle(record)
+
+
+class _WorkerKeyCache(PubKeyCache):
+    # reads the shared cache, the parent saves whatever the workers derived
+    def save(self):
+        pass
+
+
+class _Worker:
+    # the one of this process, set by _init_worker()
+    current = None
+
+    def __init__(
+        self,
+        *,
+        config_file,
+        key_backend,
+        jobs,
+        pool,
+        key_cache_path,
+        incremental,
+        writers,
+        old_manifest,
+        old_serials,
+        serial_base,
+        renderer,
+        profile,
+    ):
+        self.config_file = config_file
+        self.key_backend = key_backend
+        self.jobs = jobs
+        self.pool = pool
+        self.key_cache = _WorkerKeyCache(key_cache_path) if key_cache_path else None
+        self.incremental = incremental
+        self.writers = writers
+        self.old_manifest = old_manifest
+        self.old_serials = old_serials
+        self.serial_base = serial_base
+        self.renderer = renderer
+        self.profile = profile
+
+    def run(self, server_yaml, leases):
+        logger = logging.getLogger("genwg")
+        profiler = Profiler(enabled=self.profile)
+
+        config = ConfigYAML(
+            self.config_file,
+            logger,
+            key_backend=self.key_backend,
+            jobs=self.jobs,
+            pool=self.pool,
+            key_cache=self.key_cache,
+            leases_file=None,
+            profiler=profiler,
+        )
+        config.yaml_parsed = {"servers": [server_yaml]}
+        config.leases = leases
+
+        # the manifest and the serials come from the parent, which already
+        # created genwg_dump
+        genfiles = GenFiles(
+            config,
+            logger,
+            incremental=self.incremental,
+            writers=self.writers,
+            renderer=self.renderer,
+            profiler=profiler,
+        )
+        genfiles.old_manifest = self.old_manifest
+        genfiles.old_serials = self.old_serials
+        genfiles.serial_base = self.serial_base
+
+        records = {"parse": [], "derive_keys": [], "template": []}
+
+        try:
+            for name, step in (
+                ("parse", config.parse_yaml),
+                ("derive_keys", config.derive_keys),
+                ("template", genfiles.template),
+            ):
+                with _recording(records[name]), profiler.phase(name):
+                    step()
+        except SystemExit:
+            # the error is the last record, replaying it stops the parent
+            pass
+        finally:
+            errors = genfiles.writer.close()
+
+        return {
+            "records": records,
+            "servers": config.servers,
+            "keys_cached": config.keys_cached,
+            "keys_derived": config.keys_derived,
+            "manifest": genfiles.manifest,
+            "serials": genfiles.serials,
+            "written": genfiles.written,
+            "unchanged": genfiles.unchanged,
+            "errors": [(path, str(exc)) for path, exc in errors],
+            "phases": profiler.phases,
+            "counts": profiler.counts,
+        }
+
+
+def _init_worker(level, settings):
+    # records go back to the parent instead of to the inherited handlers
+    root = logging.getLogger()
+    root.handlers = []
+    root.setLevel(level)
+
+    _Worker.current = _Worker(**settings)
+
+
+def _run_server(server_yaml, leases):
+    return _Worker.current.run(server_yaml, leases)
+
+
+class Shards:
+    # servers are independent once the configuration is validated, so every
+    # one of them gets parsed, its keys derived and its files rendered and
+    # written in a worker process. log records of the workers are replayed in
+    # the order a serial run would have logged them and the servers are
+    # merged back for the yaml and lease dumps.
+    def __init__(
+        self,
+        config_file,
+        parent_logger,
+        shards,
+        *,
+        key_backend=None,
+        jobs=1,
+        pool="process",
+        key_cache=None,
+        incremental=False,
+        writers=4,
+        renderer="jinja",
+        profiler=NULL_PROFILER,
+    ):
+        self.config_file = config_file
+        self.parent_logger = parent_logger
+        self.shards = shards
+        self.key_backend = key_backend
+        self.jobs = jobs
+        self.pool = pool
+        self.key_cache = key_cache
+        self.incremental = incremental
+        self.writers = writers
+        self.renderer = renderer
+        self.profiler = profiler
+
+    def _map(self, config, genfiles):
+        settings = {
+            "config_file": self.config_file,
+            "key_backend": config.key_backend,
+            "jobs": self.jobs,
+            "pool": self.pool,
+            "key_cache_path": self.key_cache.path if self.key_cache else None,
+            "incremental": genfiles.fingerprints,
+            "writers": self.writers,
+            "old_manifest": genfiles.old_manifest,
+            "old_serials": genfiles.old_serials,
+            "serial_base": genfiles.serial_base,
+            "renderer": self.renderer,
+            "profile": self.profiler.enabled,
+        }
+
+        servers_yaml = config.yaml_parsed["servers"]
+        leases = []
+
+        for server_yaml in servers_yaml:
+            name = server_yaml.get("name")
+            leases.append({name: config.leases[name]} if name in config.leases else {})
+
+        executor = ProcessPoolExecutor(
+            self.shards,
+            initializer=_init_worker,
+            initargs=(self.parent_logger.getEffectiveLevel(), settings),
+        )
+        results = []
+
+        try:
+            for result in executor.map(_run_server, servers_yaml, leases):
+                # parsing is logged as servers come back, in their order
+                _replay(result["records"]["parse"])
+                results.append(result)
+        finally:
+            executor.shutdown(cancel_futures=True)
+
+        return results
+
+    def _derive_keys(self, config, results):
+        config.logger.info("deriving keys")
+        config.logger.info(
+            "%s cached, %s to derive",
+            sum(result["keys_cached"] for result in results),
+            sum(result["keys_derived"] for result in results),
+        )
+
+        for result in results:
+            _replay(
+                record
+                for record in result["records"]["derive_keys"]
+                if record.levelno >= logging.WARNING
+            )
+
+        if not self.key_cache:
+            return
+
+        self.key_cache.load()
+
+        for result in results:
+            for server in result["servers"]:
+                for peer in [server, *server.clients]:
+                    self.key_cache.put(peer.priv, peer.pub)
+
+        try:
+            self.key_cache.save()
+        except OSError as exc:
+            config.logger.warning("failed saving the key cache: %s", exc)
+
+    def run(self):
+        config = ConfigYAML(
+            self.config_file,
+            self.parent_logger,
+            key_backend=self.key_backend,
+            key_cache=self.key_cache,
+            profiler=self.profiler,
+        )
+        config.run(parse=False)
+
+        genfiles = GenFiles(
+            config,
+            self.parent_logger,
+            incremental=self.incremental,
+            writers=self.writers,
+            profiler=self.profiler,
+        )
+
+        # logged after the keys like a serial run would, unless it fails
+        dirs_records = []
+
+        try:
+            with _recording(dirs_records), self.profiler.phase("create_dirs"):
+                genfiles.create_dirs()
+        except SystemExit:
+            _replay(dirs_records)
+
+        with self.profiler.phase("shards"):
+            results = self._map(config, genfiles)
+
+        self._derive_keys(config, results)
+        _replay(dirs_records)
+
+        for result in results:
+            _replay(result["records"]["template"])
+
+            config.servers.extend(result["servers"])
+            genfiles.manifest.update(result["manifest"])
+            genfiles.serials.update(result["serials"])
+            genfiles.written += result["written"]
+            genfiles.unchanged += result["unchanged"]
+            genfiles.writer.errors.extend(result["errors"])
+
+            self.profiler.merge(result["phases"], result["counts"])
+
+        config.count_peers()
+        genfiles.run(render=False)
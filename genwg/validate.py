@@ -0,0 +1,625 @@
+import ipaddress
+import re
+
+import yaml
+
+from .keys import WGKeyError, _decode_key
+from .loader import SafeLoader
+
+_FQDN_REGEX = re.compile(
+    r"^([a-zA-Z0-9]([a-zA-Z0-9\-]{0,61}[a-zA-Z0-9])?\.)+[a-zA-Z]{2,}$"
+)
+_ZONE_REGEX = re.compile(r"^[a-zA-Z0-9.-]{1,255}$")
+_SUBD_REGEX = re.compile(r"^[a-zA-Z0-9-]{1,63}$")
+
+_BOOL = "tag:yaml.org,2002:bool"
+_INT = "tag:yaml.org,2002:int"
+_NULL = "tag:yaml.org,2002:null"
+_STR = "tag:yaml.org,2002:str"
+
+_SERVER_KEYS = {
+    "name",
+    "priv",
+    "ip",
+    "port",
+    "net",
+    "net6",
+    "mtu",
+    "extra_address",
+    "extra_allowed",
+    "named",
+    "udp2raw",
+    "clients",
+}
+_CLIENT_KEYS = {
+    "name",
+    "priv",
+    "wg_handled_dns",
+    "bind",
+    "root_zone_file",
+    "udp2raw_log_path",
+    "android",
+    "wgquick_path",
+    "udp2raw_path",
+    "append_extra",
+    "extra_allowed",
+}
+
+
+def is_fqdn(string):
+    return bool(_FQDN_REGEX.match(string)) and len(string) <= 253
+
+
+def _line(node):
+    # nodes represented out of a dict have no marks
+    if node.start_mark is None:
+        return "-"
+
+    return node.start_mark.line + 1
+
+
+class Validator:
+    # checks the whole configuration on the yaml nodes before anything is
+    # built out of it, and reports every problem instead of the first one.
+    # servers come in one at a time, only what the cross checks need is kept.
+    def __init__(self, config_file, parent_logger):
+        self.config_file = config_file
+        self.logger = parent_logger.getChild(self.__class__.__name__)
+
+        self.constructor = SafeLoader("")
+        self.errors = 0
+
+        # indexes for the checks across servers and clients
+        self.server_names = {}  # name -> line
+        self.privs = {}  # priv -> (path, line)
+        self.ports = {}  # (ip, proto, port) -> (path, line)
+        self.nets = []  # (network, path, line)
+
+    def _error(self, node, path, msg, *args):
+        self.errors += 1
+        self.logger.error(
+            "%s:%s: %s: " + msg,
+            self.config_file,
+            _line(node),
+            path,
+            *args,
+            extra={"deferred": True},
+        )
+
+    def _warning(self, node, path, msg, *args):
+        self.logger.warning(
+            "%s:%s: %s: " + msg, self.config_file, _line(node), path, *args
+        )
+
+    def _value(self, node):
+        # python value of a scalar node
+        constructor = self.constructor.yaml_constructors.get(node.tag)
+
+        if constructor is None:
+            return node.value
+
+        return constructor(self.constructor, node)
+
+    def _mapping(self, node, path, known):
+        # key -> value node, duplicate and unknown keys get reported
+        if not isinstance(node, yaml.MappingNode):
+            self._error(node, path, "must be a mapping")
+            return None
+
+        mapping = {}
+
+        for key_node, value_node in node.value:
+            key = key_node.value
+
+            if key in mapping:
+                self._error(
+                    key_node,
+                    path,
+                    "duplicate key %s, first seen on line %s",
+                    key,
+                    _line(mapping[key][0]),
+                )
+            elif known is not None and key not in known:
+                self._warning(key_node, path, "unknown key %s", key)
+
+            mapping[key] = (key_node, value_node)
+
+        return {key: value_node for key, (_, value_node) in mapping.items()}
+
+    def _blank(self, node):
+        return node.tag == _NULL or (
+            isinstance(node, (yaml.ScalarNode, yaml.SequenceNode, yaml.MappingNode))
+            and not node.value
+        )
+
+    def _required(self, mapping, node, path, keys):
+        # the keys that are there and not blank
+        present = []
+
+        for key in keys:
+            if key not in mapping:
+                self._error(node, path, "%s is missing", key)
+            elif self._blank(mapping[key]):
+                self._error(mapping[key], f"{path}.{key}", "cannot be blank")
+            else:
+                present.append(key)
+
+        return present
+
+    def _str(self, mapping, key, path):
+        node = mapping[key]
+
+        # name: 12 or ip: yes are ints and bools to the parser
+        if not isinstance(node, yaml.ScalarNode) or node.tag != _STR:
+            self._error(node, f"{path}.{key}", "must be a string")
+            return None
+
+        return node.value
+
+    def _bool(self, mapping, key, path):
+        if key not in mapping:
+            return False
+
+        node = mapping[key]
+
+        if node.tag != _BOOL:
+            self._error(node, f"{path}.{key}", "must be a bool")
+            return False
+
+        return self._value(node)
+
+    def _int(self, mapping, key, path):
+        # anything int() takes goes, like the parser itself, e.g. "51820"
+        node = mapping[key]
+
+        if node.tag == _INT:
+            return self._value(node)
+
+        if isinstance(node, yaml.ScalarNode) and node.tag != _BOOL:
+            try:
+                return int(self._value(node))
+            except (TypeError, ValueError):
+                pass
+
+        self._error(node, f"{path}.{key}", "must be an integer")
+        return None
+
+    def _port(self, mapping, key, path):
+        port = self._int(mapping, key, path)
+
+        if port is not None and not 0 < port <= 65535:
+            self._error(
+                mapping[key], f"{path}.{key}", "%s is not a valid port number", port
+            )
+            return None
+
+        return port
+
+    def _claim_port(self, node, path, ip, proto, port):
+        # two servers on the same host can not listen on the same port
+        if ip is None or port is None:
+            return
+
+        key = (ip, proto, port)
+        if key in self.ports:
+            other_path, other_line = self.ports[key]
+            self._error(
+                node,
+                path,
+                "%s port %s on %s is already used by %s on line %s",
+                proto,
+                port,
+                ip,
+                other_path,
+                other_line,
+            )
+        else:
+            self.ports[key] = (path, _line(node))
+
+    def _priv(self, mapping, path):
+        if "priv" not in mapping:
+            return
+
+        node = mapping["priv"]
+        path = f"{path}.priv"
+
+        if self._blank(node):
+            self._error(node, path, "cannot be blank")
+            return
+
+        priv = node.value
+
+        try:
+            _decode_key(priv)
+        except WGKeyError:
+            self._error(node, path, "is not a valid wireguard key")
+            return
+
+        if priv in self.privs:
+            other_path, other_line = self.privs[priv]
+            self._error(node, path, "same key as %s on line %s", other_path, other_line)
+        else:
+            self.privs[priv] = (path, _line(node))
+
+    def _network(self, node, path, version=None):
+        try:
+            network = ipaddress.ip_network(node.value)
+        except (ValueError, TypeError):
+            self._error(node, path, "invalid network: %s", node.value)
+            return None
+
+        if version is not None and network.version != version:
+            self._error(node, path, "%s is not a v%s network", network, version)
+            return None
+
+        return network
+
+    def _networks(self, mapping, key, path, single):
+        # extra_address is single addresses only, extra_allowed anything but
+        if key not in mapping:
+            return
+
+        node = mapping[key]
+        path = f"{path}.{key}"
+
+        if self._blank(node):
+            self._error(node, path, "cannot be blank")
+            return
+
+        if not isinstance(node, yaml.SequenceNode):
+            self._error(node, path, "must be a list")
+            return
+
+        for index, item in enumerate(node.value):
+            item_path = f"{path}[{index}]"
+            network = self._network(item, item_path)
+
+            if network is None:
+                continue
+
+            is_single = network.prefixlen == network.max_prefixlen
+
+            if single and not is_single:
+                self._error(item, item_path, "%s is not a /32 or a /128", network)
+            elif not single and is_single:
+                self._error(item, item_path, "cannot be a /32 or a /128")
+
+    def _subnet(self, mapping, key, path, clients, version=None):
+        node = mapping[key]
+        path = f"{path}.{key}"
+        network = self._network(node, path, version)
+
+        if network is None:
+            return None
+
+        if network.prefixlen == network.max_prefixlen:
+            self._error(node, path, "prefix length cannot be %s", network.prefixlen)
+            return None
+
+        # .0, .1 for the server and the v4 broadcast are not up for grabs
+        room = network.num_addresses - (3 if network.version == 4 else 2)
+        if clients > room:
+            self._error(
+                node, path, "%s has room for %s clients, not %s", network, room, clients
+            )
+
+        self.nets.append((network, path, _line(node)))
+
+        return network
+
+    def _server(self, index, node):
+        path = f"servers[{index}]"
+        server = self._mapping(node, path, _SERVER_KEYS)
+
+        if server is None:
+            return
+
+        present = self._required(
+            server, node, path, ("name", "ip", "port", "net", "mtu", "clients")
+        )
+
+        clients_node = server.get("clients")
+        if "clients" in present and not isinstance(clients_node, yaml.SequenceNode):
+            self._error(clients_node, f"{path}.clients", "must be a list")
+            clients_node = None
+
+        clients = len(clients_node.value) if clients_node else 0
+
+        # name
+        name = None
+        if "name" in present:
+            name = self._str(server, "name", path)
+
+        if name is not None:
+            if len(name) >= 16 or " " in name or "/" in name:
+                self._error(
+                    server["name"],
+                    f"{path}.name",
+                    "%s is not a valid interface name",
+                    name,
+                )
+
+            if name in self.server_names:
+                self._error(
+                    server["name"],
+                    f"{path}.name",
+                    "duplicate server name %s, first seen on line %s",
+                    name,
+                    self.server_names[name],
+                )
+            else:
+                self.server_names[name] = _line(server["name"])
+
+        # priv
+        self._priv(server, path)
+
+        # ip
+        ip = None
+        ip_is_fqdn = False
+        if "ip" in present:
+            ip = self._str(server, "ip", path)
+
+        if ip is not None:
+            try:
+                ip = str(ipaddress.ip_address(ip))
+            except ValueError:
+                if is_fqdn(ip):
+                    ip_is_fqdn = True
+                else:
+                    self._error(
+                        server["ip"],
+                        f"{path}.ip",
+                        "%s is neither a valid ip address nor a fqdn",
+                        ip,
+                    )
+                    ip = None
+
+        # port
+        port = None
+        if "port" in present:
+            port = self._port(server, "port", path)
+            self._claim_port(server["port"], f"{path}.port", ip, "udp", port)
+
+        # net + net6
+        network = None
+        if "net" in present:
+            network = self._subnet(server, "net", path, clients)
+
+        if "net6" in server:
+            if self._blank(server["net6"]):
+                self._error(server["net6"], f"{path}.net6", "cannot be blank")
+            else:
+                if network is not None and network.version == 6:
+                    self._error(
+                        server["net6"], f"{path}.net6", "requires net to be a v4 subnet"
+                    )
+
+                self._subnet(server, "net6", path, clients, version=6)
+
+        has_v6 = "net6" in server or (network is not None and network.version == 6)
+
+        # udp2raw
+        udp2raw = None
+        if "udp2raw" in server:
+            udp2raw_path = f"{path}.udp2raw"
+
+            if self._blank(server["udp2raw"]):
+                self._error(server["udp2raw"], udp2raw_path, "cannot be blank")
+            else:
+                udp2raw = self._mapping(
+                    server["udp2raw"], udp2raw_path, {"port", "secret"}
+                )
+
+            if udp2raw is not None:
+                if ip_is_fqdn:
+                    self._error(
+                        server["udp2raw"],
+                        udp2raw_path,
+                        "cannot have a fqdn for the server on faketcp wrapped tunnels",
+                    )
+
+                if self._required(udp2raw, server["udp2raw"], udp2raw_path, ("port",)):
+                    self._claim_port(
+                        udp2raw["port"],
+                        f"{udp2raw_path}.port",
+                        ip,
+                        "tcp",
+                        self._port(udp2raw, "port", udp2raw_path),
+                    )
+
+        # mtu
+        if "mtu" in present:
+            mtu = self._int(server, "mtu", path)
+            mtu_path = f"{path}.mtu"
+
+            if mtu is None:
+                pass
+            elif udp2raw is not None and mtu > 1340:
+                self._error(
+                    server["mtu"], mtu_path, "cannot be greater than 1340 w/ udp2raw"
+                )
+            elif mtu > 1460:
+                self._error(server["mtu"], mtu_path, "cannot be greater than 1460")
+            elif has_v6 and mtu < 1280:
+                self._error(server["mtu"], mtu_path, "cannot be lower than 1280 w/ v6")
+            elif mtu <= 0:
+                self._error(server["mtu"], mtu_path, "must be positive")
+
+        # named
+        named = False
+        if "named" in server:
+            named_path = f"{path}.named"
+
+            if self._blank(server["named"]):
+                self._error(server["named"], named_path, "cannot be blank")
+            else:
+                named_map = self._mapping(
+                    server["named"], named_path, {"hostname", "conf_dir"}
+                )
+
+                if named_map is not None:
+                    named = True
+                    self._required(
+                        named_map, server["named"], named_path, ("hostname", "conf_dir")
+                    )
+
+            if name is not None and not _ZONE_REGEX.match(name):
+                self._error(
+                    server["name"],
+                    f"{path}.name",
+                    "%s is not a valid zone owner name",
+                    name,
+                )
+
+        # extra_address + extra_allowed
+        self._networks(server, "extra_address", path, single=True)
+        self._networks(server, "extra_allowed", path, single=False)
+
+        # clients
+        if clients_node is not None:
+            client_names = {}
+
+            for client_index, client_node in enumerate(clients_node.value):
+                self._client(
+                    f"{path}.clients[{client_index}]",
+                    client_node,
+                    client_names,
+                    named,
+                    udp2raw is not None,
+                )
+
+    def _client(self, path, node, client_names, named, udp2raw):
+        client = self._mapping(node, path, _CLIENT_KEYS)
+
+        if client is None:
+            return
+
+        # name
+        if self._required(client, node, path, ("name",)):
+            name = self._str(client, "name", path)
+
+            if name is not None:
+                if name in client_names:
+                    self._error(
+                        client["name"],
+                        f"{path}.name",
+                        "duplicate client name %s, first seen on line %s",
+                        name,
+                        client_names[name],
+                    )
+                else:
+                    client_names[name] = _line(client["name"])
+
+                if named and not _SUBD_REGEX.match(name):
+                    self._error(
+                        client["name"],
+                        f"{path}.name",
+                        "%s cannot be used as a subdomain",
+                        name,
+                    )
+
+        # priv
+        self._priv(client, path)
+
+        # flags
+        wg_handled_dns = self._bool(client, "wg_handled_dns", path)
+        android = self._bool(client, "android", path)
+        bind = self._bool(client, "bind", path)
+        self._bool(client, "append_extra", path)
+
+        if udp2raw:
+            self._required(client, node, path, ("udp2raw_log_path",))
+
+            if android:
+                self._required(client, node, path, ("wgquick_path", "udp2raw_path"))
+
+        if bind:
+            if wg_handled_dns:
+                self._error(
+                    client["bind"],
+                    f"{path}.bind",
+                    "cannot have bind and wg_handled_dns on at the same time",
+                )
+
+            if android:
+                self._error(
+                    client["bind"],
+                    f"{path}.bind",
+                    "android clients do not support bind",
+                )
+
+            self._required(client, node, path, ("root_zone_file",))
+
+        # extra_allowed
+        self._networks(client, "extra_allowed", path, single=False)
+
+    def _overlaps(self):
+        # sorted by start, a subnet overlaps the previous ones when it starts
+        # before the furthest end seen so far
+        nets = sorted(
+            self.nets,
+            key=lambda net: (net[0].version, int(net[0].network_address)),
+        )
+
+        last_net = last_path = last_line = None
+        for network, path, line in nets:
+            if (
+                last_net is not None
+                and last_net.version == network.version
+                and int(network.network_address) <= int(last_net.broadcast_address)
+            ):
+                self.errors += 1
+                self.logger.error(
+                    "%s:%s: %s: %s overlaps %s of %s on line %s",
+                    self.config_file,
+                    line,
+                    path,
+                    network,
+                    last_net,
+                    last_path,
+                    last_line,
+                    extra={"deferred": True},
+                )
+
+            if last_net is None or (
+                last_net.version != network.version
+                or int(network.broadcast_address) > int(last_net.broadcast_address)
+            ):
+                last_net, last_path, last_line = network, path, line
+
+    def validate_servers(self, nodes):
+        for index, node in enumerate(nodes):
+            self._server(index, node)
+
+    def validate_document(self, root):
+        mapping = self._mapping(root, "<root>", None) if root is not None else None
+
+        if not mapping or "servers" not in mapping:
+            self.errors += 1
+            self.logger.error(
+                "%s: servers section is missing",
+                self.config_file,
+                extra={"deferred": True},
+            )
+            return
+
+        servers = mapping["servers"]
+
+        if not isinstance(servers, yaml.SequenceNode) or not servers.value:
+            self._error(servers, "servers", "must be a non-empty list")
+            return
+
+        self.validate_servers(servers.value)
+
+    def finish(self):
+        self._overlaps()
+
+        self.constructor.dispose()
+
+        if self.errors:
+            self.logger.error(
+                "%s has %s error%s",
+                self.config_file,
+                self.errors,
+                "" if self.errors == 1 else "s",
+            )
@@ -0,0 +1,111 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+
+# from <sys/inotify.h>
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_Q_OVERFLOW = 0x00004000
+_IN_NONBLOCK = os.O_NONBLOCK
+_IN_CLOEXEC = os.O_CLOEXEC
+
+_EVENT = struct.Struct("iIII")
+
+
+class InotifyWatcher:
+    # watches the directory rather than the file itself, editors tend to
+    # write a new file and rename it over the old one
+    _MASK = _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE
+
+    def __init__(self, path, settle=0.05):
+        self.dirname = os.path.dirname(os.path.abspath(path))
+        self.filename = os.path.basename(path).encode()
+        self.settle = settle
+
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+
+        self.fd = libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        if libc.inotify_add_watch(self.fd, self.dirname.encode(), self._MASK) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, f"inotify_add_watch on {self.dirname} failed")
+
+    def _read(self, timeout):
+        # whether any of the pending events were about our file
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return False
+
+        try:
+            buf = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return False
+
+        changed = False
+        offset = 0
+
+        while offset < len(buf):
+            _, mask, _, length = _EVENT.unpack_from(buf, offset)
+            offset += _EVENT.size
+            name = buf[offset : offset + length].rstrip(b"\0")
+            offset += length
+
+            if mask & _IN_Q_OVERFLOW or name == self.filename:
+                changed = True
+
+        return changed
+
+    def wait(self):
+        while not self._read(None):
+            pass
+
+        # let a burst of writes settle before handing out a single change
+        while self._read(self.settle):
+            pass
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollWatcher:
+    def __init__(self, path, interval=1.0):
+        self.path = path
+        self.interval = interval
+        self.state = self._stat()
+
+    def _stat(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+
+        return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+    def wait(self):
+        while True:
+            time.sleep(self.interval)
+
+            state = self._stat()
+            if state != self.state:
+                self.state = state
+                return
+
+    def close(self):
+        pass
+
+
+def get_watcher(path, interval=1.0):
+    # inotify where there is one, stat() polling everywhere else
+    try:
+        return InotifyWatcher(path)
+    except (OSError, AttributeError, TypeError):
+        return PollWatcher(path, interval)
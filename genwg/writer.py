@@ -0,0 +1,307 @@
+import os
+import queue
+import sys
+import threading
+import time
+
+from .profiling import NULL_PROFILER
+
+
+def source_date_epoch():
+    # $SOURCE_DATE_EPOCH, None when it is not set
+    epoch = os.environ.get("SOURCE_DATE_EPOCH")
+
+    return None if epoch is None else int(epoch)
+
+
+def _private(path):
+    # peer configurations and the yaml dump carry private keys
+    return path.startswith(("server/", "client/")) or path.endswith("-genwg.yml")
+
+
+def _chunks(data):
+    # data is either a str or an iterable of them, e.g. Template.generate()
+    return (data,) if isinstance(data, str) else data
+
+
+def _open_tmp(path, mode):
+    # tempfile.mkstemp() creates files 0600 regardless of the umask. this
+    # leaves the mode to the kernel and the umask, like open() would.
+    dirname = os.path.dirname(path) or "."
+    prefix = f".{os.path.basename(path)}."
+    flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_CLOEXEC", 0)
+
+    while True:
+        tmp_path = os.path.join(dirname, f"{prefix}{os.urandom(6).hex()}.tmp")
+
+        try:
+            return os.open(tmp_path, flags, mode), tmp_path
+        except FileExistsError:
+            continue
+
+
+def write_atomic(path, data, mode=0o666):
+    # readers either see the old file or the new one, never half of either
+    fd, tmp_path = _open_tmp(path, mode)
+
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as tmp_file:
+            for chunk in _chunks(data):
+                tmp_file.write(chunk)
+
+            # on disk before the rename, a crash in between would otherwise
+            # leave the new name pointing at an empty file
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+        raise
+
+
+class ArtifactWriter:
+    def __init__(self, root, workers=4, queue_size=256, profiler=NULL_PROFILER):
+        self.root = root
+        self.workers = workers
+        self.profiler = profiler
+
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.threads = []
+        self.errors = []
+        self.errors_lock = threading.Lock()
+
+    def _write(self, path, data):
+        # rendering happens here too when data is a generator, so anything
+        # can go wrong. a dead worker would leave the queue stuck.
+        try:
+            with self.profiler.phase("write"):
+                write_atomic(
+                    os.path.join(self.root, path),
+                    data,
+                    mode=0o600 if _private(path) else 0o666,
+                )
+        except Exception as exc:
+            with self.errors_lock:
+                self.errors.append((path, exc))
+
+    def _worker(self):
+        while True:
+            item = self.queue.get()
+
+            if item is None:
+                break
+
+            self._write(*item)
+
+    def start(self):
+        for _ in range(self.workers):
+            thread = threading.Thread(target=self._worker, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def write(self, path, data):
+        # without workers writes happen right away in the calling thread,
+        # otherwise this blocks once queue_size writes are pending
+        if not self.threads:
+            self._write(path, data)
+        else:
+            self.queue.put((path, data))
+
+    def close(self):
+        for _ in self.threads:
+            self.queue.put(None)
+
+        for thread in self.threads:
+            thread.join()
+
+        self.threads = []
+
+        return self.errors
+
+
+class ArchiveWriter:
+    # streams artifacts straight into a single tar or zip archive, with fixed
+    # ownership, modes and mtimes so that the same input yields the same bytes
+    _DIRS = ("server", "client", "bind", "bind/zone", "bind/zone/genwg")
+    _SPOOL_SIZE = 1024 * 1024
+
+    def __init__(self, target, root, archive_format=None, profiler=NULL_PROFILER):
+        self.target = target
+        self.root = root
+        self.profiler = profiler
+        self.archive_format = archive_format or self.guess_format(target)
+
+        # honour SOURCE_DATE_EPOCH, zip can not go below 1980
+        self.mtime = source_date_epoch() or 0
+        if self.archive_format == "zip":
+            self.mtime = max(self.mtime, 315532800)
+
+        self.fileobj = None
+        self.gzip = None
+        self.archive = None
+        self.errors = []
+
+    @staticmethod
+    def guess_format(target):
+        if target.endswith((".tar.gz", ".tgz")):
+            return "tgz"
+
+        if target.endswith(".zip"):
+            return "zip"
+
+        return "tar"
+
+    def _add(self, path, data=None):
+        import tarfile
+        import tempfile
+        import zipfile
+
+        name = f"{self.root}/{path}" if path else self.root
+        mode = 0o600 if _private(path) else 0o644
+
+        if self.archive_format == "zip":
+            info = zipfile.ZipInfo(
+                f"{name}/" if data is None else name,
+                date_time=time.gmtime(self.mtime)[:6],
+            )
+            info.compress_type = zipfile.ZIP_DEFLATED
+            info.external_attr = (0o40755 if data is None else 0o100000 | mode) << 16
+
+            if data is None:
+                self.archive.writestr(info, b"")
+            else:
+                with self.archive.open(info, "w") as entry:
+                    for chunk in _chunks(data):
+                        entry.write(chunk.encode("utf-8"))
+        else:
+            info = tarfile.TarInfo(name)
+            info.mtime = self.mtime
+            info.uid = info.gid = 0
+            info.uname = info.gname = ""
+
+            if data is None:
+                info.type = tarfile.DIRTYPE
+                info.mode = 0o755
+                self.archive.addfile(info)
+            else:
+                # tar headers carry the size up front, large files spill over
+                # to disk instead of being held in memory
+                with tempfile.SpooledTemporaryFile(max_size=self._SPOOL_SIZE) as spool:
+                    for chunk in _chunks(data):
+                        spool.write(chunk.encode("utf-8"))
+
+                    info.mode = mode
+                    info.size = spool.tell()
+                    spool.seek(0)
+
+                    self.archive.addfile(info, spool)
+
+    def start(self):
+        # only archives need these, imported here to keep startup light
+        import gzip
+        import tarfile
+        import zipfile
+
+        try:
+            # all of these stay open until close()
+            if self.target == "-":
+                self.fileobj = sys.stdout.buffer
+            else:
+                self.fileobj = open(  # pylint: disable=consider-using-with
+                    self.target, "wb"
+                )
+
+            if self.archive_format == "zip":
+                self.archive = zipfile.ZipFile(self.fileobj, "w")
+            else:
+                tar_fileobj = self.fileobj
+
+                # tarfile would stamp the gzip header with the current time
+                if self.archive_format == "tgz":
+                    self.gzip = gzip.GzipFile(
+                        filename="", mode="wb", fileobj=self.fileobj, mtime=self.mtime
+                    )
+                    tar_fileobj = self.gzip
+
+                # stream mode, no seeking so that stdout works too
+                self.archive = tarfile.open(  # pylint: disable=consider-using-with
+                    fileobj=tar_fileobj, mode="w|", format=tarfile.PAX_FORMAT
+                )
+
+            self._add("")
+            for path in self._DIRS:
+                self._add(path)
+        except OSError as exc:
+            self.errors.append((self.target, exc))
+
+    def write(self, path, data):
+        if self.errors:
+            return
+
+        try:
+            with self.profiler.phase("write"):
+                self._add(path, data)
+        except Exception as exc:
+            self.errors.append((path, exc))
+
+    def close(self):
+        try:
+            if self.archive:
+                self.archive.close()
+
+            if self.gzip:
+                self.gzip.close()
+
+            if self.fileobj:
+                if self.target == "-":
+                    self.fileobj.flush()
+                else:
+                    self.fileobj.close()
+        except OSError as exc:
+            self.errors.append((self.target, exc))
+
+        self.archive = None
+        self.gzip = None
+        self.fileobj = None
+
+        return self.errors
+
+
+class PendingWriter:
+    # keeps the (path, data) pairs as they come, jinja output gets rendered
+    # only once whoever goes through them gets to it
+    def __init__(self):
+        self.files = []
+
+    def start(self):
+        pass
+
+    def write(self, path, data):
+        self.files.append((path, data))
+
+    def close(self):
+        return []
+
+
+class MemoryWriter:
+    # keeps everything rendered in memory, nothing touches the disk
+    def __init__(self):
+        self.files = {}
+        self.errors = []
+
+    def start(self):
+        pass
+
+    def write(self, path, data):
+        try:
+            self.files[path] = "".join(_chunks(data))
+        except Exception as exc:
+            self.errors.append((path, exc))
+
+    def close(self):
+        return self.errors